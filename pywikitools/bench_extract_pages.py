@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Compare the parsers of sift_wiki.extract_pages on a synthetic dump:
+pages per second and peak memory. Each parser runs in its own process, so
+that its peak RSS isn't mixed up with the other's."""
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import click
+
+from sift_wiki import extract_pages
+
+HEADER = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+  </siteinfo>
+'''
+PAGE = '''  <page>
+    <title>Page %(id)d</title>
+    <ns>%(ns)d</ns>
+    <id>%(id)d</id>
+    <revision>
+      <id>%(rev)d</id>
+      <timestamp>2017-01-01T00:00:00Z</timestamp>
+      <contributor><username>Bench</username><id>1</id></contributor>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve">%(text)s</text>
+    </revision>
+  </page>
+'''
+FOOTER = '</mediawiki>\n'
+
+
+def write_dump(loc, size_mb, seed=0):
+    """Write pages of random words until the dump is size_mb megabytes. One
+    page in five is outside the main namespace."""
+    random.seed(seed)
+    words = ['word%d' % i for i in range(5000)] + ['[[link]]', "'''bold'''", '{{cite}}']
+    limit = size_mb * 1000000
+    n_pages = 0
+    with open(loc, 'w', encoding='utf8') as file_:
+        file_.write(HEADER)
+        written = len(HEADER)
+        while written < limit:
+            text = ' '.join(random.choice(words) for _ in range(random.randint(50, 5000)))
+            page = PAGE % {'id': n_pages + 1, 'rev': n_pages + 1000000,
+                           'ns': 0 if n_pages % 5 else 4, 'text': text}
+            file_.write(page)
+            written += len(page)
+            n_pages += 1
+        file_.write(FOOTER)
+    return n_pages
+
+
+def run_parser(loc, parser, namespaces):
+    filter_namespaces = tuple(namespaces.split(',')) if namespaces else False
+    start = time.time()
+    n_pages = 0
+    n_chars = 0
+    with open(loc, 'rb') as file_:
+        for title, text, pageid in extract_pages(file_, filter_namespaces=filter_namespaces,
+                                                 parser=parser):
+            n_pages += 1
+            n_chars += len(text)
+    seconds = time.time() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('%s\t%d\t%d\t%.3f\t%.1f' % (parser, n_pages, n_chars, seconds, peak_mb))
+
+
+@click.command()
+@click.argument('loc', default='synthetic-pages-articles.xml')
+@click.option('--size_mb', default=4000, help='size of the synthetic dump, if it has to be written')
+@click.option('--namespaces', default='', help='comma-separated namespaces to keep, e.g. 0')
+@click.option('--parser', default=None, help='run one parser in this process, used by the benchmark')
+def main(loc, size_mb, namespaces, parser):
+    if parser:
+        run_parser(loc, parser, namespaces)
+        return
+    if not os.path.exists(loc):
+        print('Writing %d MB to %s' % (size_mb, loc))
+        print('%d pages' % write_dump(loc, size_mb))
+    results = {}
+    for name in ('etree', 'lxml'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, loc, '--parser', name, '--namespaces', namespaces])
+        parser_name, n_pages, n_chars, seconds, peak_mb = output.decode('utf8').split()
+        results[name] = (int(n_pages), int(n_chars))
+        print('%-6s %8.0f pages/s %7.1f MB/s, peak RSS %7.1f MB' % (
+            name, int(n_pages) / float(seconds), os.path.getsize(loc) / 1e6 / float(seconds),
+            float(peak_mb)))
+    assert results['etree'] == results['lxml']
+
+
+if __name__ == '__main__':
+    main()
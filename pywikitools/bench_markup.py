@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Compare the markup stripping engines of sift_wiki on the first pages of a
+dump: throughput in characters of wikitext per second, how many pages come
+out differently, and the time spent in each pattern."""
+import time
+
+import click
+from gensim.corpora.wikicorpus import extract_pages
+
+from bz2_blocks import open_bz2
+from sift_wiki import ENGINES, WikiCleaner
+
+
+def best_time(cleaner, engine, texts, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        results = [cleaner.filter_wiki(text, engine=engine) for text in texts]
+        times.append(time.time() - start)
+    return min(times), results
+
+
+@click.command()
+@click.argument('dump', type=click.Path(exists=True))
+@click.option('--pages', default=1000, help='number of pages to read from the dump')
+@click.option('--repeat', default=3, help='number of timed runs per engine')
+@click.option('--language', default='en', help='language of the dump')
+def main(dump, pages, repeat, language):
+    texts = []
+    for title, text, pageid in extract_pages(open_bz2(dump)):
+        texts.append(text)
+        if len(texts) >= pages:
+            break
+    n_chars = sum(len(text) for text in texts)
+    print('%d pages, %.1f M chars' % (len(texts), n_chars / 1e6))
+    baseline = None
+    for engine in sorted(ENGINES, key=lambda name: name != 'regex'):
+        cleaner = WikiCleaner(language)
+        seconds, results = best_time(cleaner, engine, texts, repeat)
+        if baseline is None:
+            baseline = results
+        n_diff = sum(a != b for a, b in zip(baseline, results))
+        print('%-12s %.2fs %.2f M chars/s, %d pages differ from regex' % (
+            engine, seconds, n_chars / seconds / 1e6, n_diff))
+        for name, pattern_seconds, hits in cleaner.report():
+            print('  %-18s %6.2fs %9d hits' % (name, pattern_seconds / repeat, hits // repeat))
+
+
+if __name__ == '__main__':
+    main()
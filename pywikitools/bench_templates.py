@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Compare sift_wiki.remove_template with the previous character-by-character
+implementation, on synthetic text with deeply nested templates."""
+import random
+import time
+
+import click
+
+from sift_wiki import remove_template
+
+
+def remove_template_by_char(s):
+    """The previous implementation, which loops over every character."""
+    n_open, n_close = 0, 0
+    starts, ends = [], []
+    in_template = False
+    prev_c = None
+    for i, c in enumerate(iter(s)):
+        if not in_template:
+            if c == '{' and c == prev_c:
+                starts.append(i - 1)
+                in_template = True
+                n_open = 1
+        if in_template:
+            if c == '{':
+                n_open += 1
+            elif c == '}':
+                n_close += 1
+            if n_open == n_close:
+                ends.append(i)
+                in_template = False
+                n_open, n_close = 0, 0
+        prev_c = c
+    s = ''.join([s[end + 1:start] for start, end in
+                 zip(starts + [None], [-1] + ends)])
+    return s
+
+
+def nested_template(depth, width):
+    """A template with depth levels of templates nested in its parameters."""
+    if depth == 0:
+        return '{{cite|%s}}' % ('x' * width)
+    return '{{infobox|a=%s|b=%s|c=%s}}' % (
+        'y' * width, nested_template(depth - 1, width), '{{flag|z}}')
+
+
+def make_text(n_templates, depth, width, seed=0):
+    random.seed(seed)
+    parts = []
+    for _ in range(n_templates):
+        parts.append('Some article text with a {single} brace. ' * random.randint(1, 20))
+        parts.append(nested_template(random.randint(0, depth), width))
+    return '\n'.join(parts)
+
+
+def best_time(func, text, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = func(text)
+        times.append(time.time() - start)
+    return min(times), result
+
+
+@click.command()
+@click.option('--templates', default=2000, help='number of top-level templates')
+@click.option('--depth', default=30, help='maximum nesting depth')
+@click.option('--width', default=200, help='characters of text in each parameter')
+@click.option('--repeat', default=3, help='number of timed runs per implementation')
+def main(templates, depth, width, repeat):
+    text = make_text(templates, depth, width)
+    print('%.1f M chars' % (len(text) / 1e6))
+    by_char, old = best_time(remove_template_by_char, text, repeat)
+    by_find, new = best_time(remove_template, text, repeat)
+    assert old == new
+    print('by char: %.3fs' % by_char)
+    print('by find: %.3fs (%.1fx)' % (by_find, by_char / by_find))
+
+
+if __name__ == '__main__':
+    main()
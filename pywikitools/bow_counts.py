@@ -0,0 +1,85 @@
+"""Term and document frequencies of a bag-of-words Matrix Market corpus.
+
+The corpus written by MmCorpus.serialize has a line "doc_id term_id count"
+for every word of every document, 1-based. Instead of iterating over the
+documents in Python, the file is read in large blocks, each block is parsed
+by numpy into an array of (doc_id, term_id, count) rows, and the frequencies
+are summed with bincount. Every (doc_id, term_id) pair occurs once, so the
+document frequency of a term is its number of rows.
+"""
+import bz2
+import gzip
+import io
+
+import numpy as np
+
+
+def open_mm(loc):
+    if loc.endswith('.bz2'):
+        return bz2.open(loc, 'rb')
+    elif loc.endswith('.gz'):
+        return gzip.open(loc, 'rb')
+    return open(loc, 'rb')
+
+
+def read_mm_header(file_):
+    """Skip the banner and comments, and return num_docs, num_terms and
+    num_nnz from the size line."""
+    line = file_.readline()
+    if not line.startswith(b'%%MatrixMarket'):
+        raise ValueError("not a Matrix Market file")
+    while line.startswith(b'%'):
+        line = file_.readline()
+    num_docs, num_terms, num_nnz = (int(field) for field in line.split())
+    return num_docs, num_terms, num_nnz
+
+
+def iter_mm_blocks(file_, block_bytes=1 << 26):
+    """Yield the entries of the rest of file_ as float arrays of shape (n, 3),
+    block_bytes of text at a time. Blocks are cut after the last full line."""
+    rest = b''
+    while True:
+        data = file_.read(block_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        rest = data[end:]
+        if end:
+            yield _parse_entries(data[:end])
+    if rest.strip():
+        yield _parse_entries(rest)
+
+
+def _parse_entries(data):
+    values = np.fromstring(data.decode('ascii'), dtype='float64', sep=' ')
+    if len(values) % 3:
+        raise ValueError("Matrix Market entries should have 3 fields")
+    return values.reshape(-1, 3)
+
+
+def mm_frequencies(loc, block_bytes=1 << 26):
+    """Return the term frequencies and document frequencies of the corpus
+    at loc, as int64 arrays indexed by term id."""
+    with open_mm(loc) as file_:
+        num_docs, num_terms, num_nnz = read_mm_header(file_)
+        term_freqs = np.zeros(num_terms, dtype='int64')
+        doc_freqs = np.zeros(num_terms, dtype='int64')
+        for entries in iter_mm_blocks(file_, block_bytes):
+            term_ids = entries[:, 1].astype('int64') - 1
+            term_freqs += np.bincount(term_ids, weights=entries[:, 2],
+                                      minlength=num_terms).round().astype('int64')
+            doc_freqs += np.bincount(term_ids, minlength=num_terms)
+    return term_freqs, doc_freqs
+
+
+def write_freqs(loc, term_freqs, doc_freqs, words, batch_size=100000):
+    """Write freq, doc_freq and repr(word) lines, the format init.py reads,
+    in batches of lines rather than a write per line."""
+    with io.open(loc, 'w', encoding='utf8') as file_:
+        for start in range(0, len(words), batch_size):
+            end = start + batch_size
+            file_.write(''.join(
+                '%d\t%d\t%r\n' % row for row in zip(np.asarray(term_freqs[start:end]).tolist(),
+                                                     np.asarray(doc_freqs[start:end]).tolist(),
+                                                     words[start:end])))
@@ -0,0 +1,175 @@
+"""Decompress multi-stream bz2 files in parallel.
+
+pbzip2 archives and Wikipedia multistream dumps are concatenations of
+independent bz2 streams. We find where each stream starts, cache the offsets
+in an index file next to the archive, and decompress groups of streams in a
+process pool, handing the data back in order.
+
+training/word_freqs.py reads its comment files with open_bz2.
+"""
+from __future__ import unicode_literals
+
+import bz2
+import collections
+import multiprocessing
+import os
+import re
+
+# Stream header ("BZh" + block size) directly followed by the magic number
+# of the first block, which is byte-aligned only at the start of a stream.
+STREAM_MAGIC = re.compile(b'BZh[1-9]1AY&SY')
+INDEX_SUFFIX = '.streams'
+
+
+def find_streams(loc, buffer_size=1 << 24):
+    offsets = []
+    overlap = 9
+    with open(loc, 'rb') as file_:
+        pos = 0
+        tail = b''
+        while True:
+            data = file_.read(buffer_size)
+            if not data:
+                break
+            buf = tail + data
+            base = pos - len(tail)
+            for match in STREAM_MAGIC.finditer(buf):
+                offsets.append(base + match.start())
+            tail = buf[-overlap:]
+            pos += len(data)
+    if not offsets or offsets[0] != 0:
+        offsets.insert(0, 0)
+    return offsets
+
+
+def load_index(loc):
+    """Return the stream offsets of loc, using the cached index if it's still
+    valid for the file's size and modification time."""
+    stat = os.stat(loc)
+    key = ['%d' % stat.st_size, '%d' % stat.st_mtime]
+    index_loc = loc + INDEX_SUFFIX
+    if os.path.exists(index_loc):
+        with open(index_loc) as file_:
+            if file_.readline().split() == key:
+                return [int(line) for line in file_]
+    offsets = find_streams(loc)
+    try:
+        with open(index_loc + '.tmp', 'w') as file_:
+            file_.write(' '.join(key) + '\n')
+            for offset in offsets:
+                file_.write('%d\n' % offset)
+        os.rename(index_loc + '.tmp', index_loc)
+    except (IOError, OSError):
+        pass  # Read-only location, we just don't cache the index.
+    return offsets
+
+
+def iter_ranges(offsets, size, chunk_bytes):
+    """Group consecutive streams into (start, end) byte ranges of at least
+    chunk_bytes compressed bytes."""
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= chunk_bytes:
+            yield start, offset
+            start = offset
+    if start < size:
+        yield start, size
+
+
+def decompress_range(args):
+    loc, start, end = args
+    with open(loc, 'rb') as file_:
+        file_.seek(start)
+        data = file_.read(end - start)
+    chunks = []
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+
+class BZ2BlockFile(object):
+    """Read-only file object over a multi-stream bz2 file, decompressed by a
+    pool of n_procs processes. Iterating yields lines, like bz2.BZ2File."""
+    def __init__(self, loc, n_procs=None, chunk_bytes=1 << 22, offsets=None):
+        self.loc = loc
+        self.n_procs = n_procs or multiprocessing.cpu_count()
+        self.chunk_bytes = chunk_bytes
+        self.offsets = offsets if offsets is not None else load_index(loc)
+        self._pool = None
+        self._chunks = self._iter_chunks()
+        self._buffer = b''
+        self._pos = 0
+
+    def _iter_chunks(self):
+        self._pool = multiprocessing.Pool(self.n_procs)
+        size = os.path.getsize(self.loc)
+        pending = collections.deque()
+        try:
+            for start, end in iter_ranges(self.offsets, size, self.chunk_bytes):
+                pending.append(self._pool.apply_async(decompress_range,
+                                                      ((self.loc, start, end),)))
+                if len(pending) >= self.n_procs * 2:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            self._pool.terminate()
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            size = len(self._buffer) - self._pos
+        while len(self._buffer) - self._pos < size and self._fill():
+            pass
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        while True:
+            end = self._buffer.find(b'\n', self._pos)
+            if end != -1:
+                line = self._buffer[self._pos:end + 1]
+                self._pos = end + 1
+                return line
+            if not self._fill():
+                line = self._buffer[self._pos:]
+                self._pos = len(self._buffer)
+                return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        self._chunks.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_bz2(loc, n_procs=1):
+    """Open loc with parallel decompression if it has several streams to
+    spread over n_procs processes, or as a plain bz2.BZ2File otherwise."""
+    if n_procs > 1:
+        offsets = load_index(loc)
+        if len(offsets) > 1:
+            return BZ2BlockFile(loc, n_procs=n_procs, offsets=offsets)
+    return bz2.BZ2File(loc)
@@ -0,0 +1,180 @@
+"""Download dump files concurrently, resuming partial downloads.
+
+Each file is downloaded to file + '.part' with HTTP Range requests, so that a
+dropped connection or an interrupted run continues where it stopped instead
+of starting over. Several files are fetched at once over a pooled session.
+Finished files are checked against the md5 or sha1 sums published next to
+the dumps before they're renamed into place.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import re
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+# Data is read from the socket in small chunks, since a chunk that's cut off by
+# a dropped connection is lost, and written to disk in large buffered writes.
+READ_SIZE = 1 << 16
+CHUNK_SIZE = 1 << 20
+
+
+# The sums under /latest/ list the dated file names, frwiki-20170101-...,
+# while the files are linked as frwiki-latest-...
+DUMP_DATE = re.compile(r'^(\w+?wiki)-(?:\d{8}|latest)-')
+
+
+# The dump files of each layout, after <language>wiki-latest-pages-articles:
+# the split dumps, the multistream dump with its index, or the multistream dump
+# split in parts with an index each. Wikis that publish both multistream
+# layouts would otherwise be downloaded twice.
+DUMP_LAYOUTS = {
+    # frwiki-latest-pages-articles1.xml-p000000003p000412300.bz2
+    'articles': r'\d+\.xml-p\d*p\d*\.bz2$',
+    # frwiki-latest-pages-articles-multistream.xml.bz2
+    # and frwiki-latest-pages-articles-multistream-index.txt.bz2
+    'multistream': r'-multistream(\.xml|-index\.txt)\.bz2$',
+    # frwiki-latest-pages-articles-multistream1.xml-p1p306134.bz2
+    # and frwiki-latest-pages-articles-multistream-index1.txt-p1p306134.bz2
+    'multistream_parts': r'-multistream(\d+\.xml|-index\d+\.txt)-p\d+p\d+\.bz2$',
+}
+
+
+def dump_links(links, language, layout='articles'):
+    """The links to the dump files of language in the given layout."""
+    pattern = re.compile(re.escape(language) + r'wiki-latest-pages-articles' +
+                         DUMP_LAYOUTS[layout])
+    return [link for link in links if pattern.match(link)]
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def make_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def checksum_key(name):
+    """The name a file's checksum is looked up by, without the dump date."""
+    return DUMP_DATE.sub(r'\1-*-', name)
+
+
+def parse_checksums(text):
+    """Parse the lines of a md5sums.txt or sha1sums.txt file, "hash  name"."""
+    checksums = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            checksums[fields[1]] = fields[0]
+    return checksums
+
+
+def fetch_checksums(session, base_url, prefix):
+    """Return {checksum_key(file name): (algorithm, hash)} from the sums
+    published in the dump directory, e.g. frwiki-latest-md5sums.txt. sha1 is
+    preferred when both are there. Missing sum files are skipped."""
+    checksums = {}
+    for algorithm in ('md5', 'sha1'):
+        url = urljoin(base_url + '/', '%s-%ssums.txt' % (prefix, algorithm))
+        response = session.get(url)
+        if response.status_code != 200:
+            logger.warning('no %s sums at %s', algorithm, url)
+            continue
+        for name, digest in parse_checksums(response.text).items():
+            checksums[checksum_key(name)] = (algorithm, digest)
+    return checksums
+
+
+def file_digest(loc, algorithm, chunk_size=CHUNK_SIZE):
+    digest = hashlib.new(algorithm)
+    with open(loc, 'rb') as file_:
+        for chunk in iter(lambda: file_.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fetch(session, url, part_loc, chunk_size):
+    """Append the rest of url to part_loc, from its current size. Returns
+    False if the server can't serve a range, and the file must be started
+    over."""
+    start = os.path.getsize(part_loc) if os.path.exists(part_loc) else 0
+    headers = {'Range': 'bytes=%d-' % start} if start else {}
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:
+            # Range not satisfiable: we already have the whole file.
+            return True
+        response.raise_for_status()
+        if start and response.status_code != 206:
+            logger.warning('%s: range requests not supported, restarting', url)
+            os.remove(part_loc)
+            return False
+        with open(part_loc, 'ab', buffering=chunk_size) as file_:
+            for chunk in response.iter_content(chunk_size=READ_SIZE):
+                file_.write(chunk)
+    return True
+
+
+def download_file(session, url, directory, checksum=None, retries=5, chunk_size=CHUNK_SIZE):
+    """Download url into directory, resuming from a partial download, and
+    return the location of the file. checksum is an (algorithm, hash) pair to
+    check the file against. A file that's already there and matches the
+    checksum isn't downloaded again."""
+    loc = os.path.join(directory, urlparse(url).path.split('/')[-1])
+    if os.path.exists(loc) and (checksum is None or file_digest(loc, checksum[0]) == checksum[1]):
+        logger.info('%s already downloaded', loc)
+        return loc
+    part_loc = loc + PART_SUFFIX
+    for attempt in range(retries + 1):
+        try:
+            if _fetch(session, url, part_loc, chunk_size):
+                break
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            logger.warning('%s: %s, resuming', url, e)
+    else:
+        raise IOError('%s: could not download after %d attempts' % (url, retries + 1))
+    if checksum is not None:
+        algorithm, expected = checksum
+        digest = file_digest(part_loc, algorithm)
+        if digest != expected:
+            # A corrupt partial file would only be resumed, so start over next time.
+            os.remove(part_loc)
+            raise ChecksumError('%s: %s is %s, expected %s' % (url, algorithm, digest, expected))
+    os.rename(part_loc, loc)
+    logger.info('downloaded %s', loc)
+    return loc
+
+
+def download_files(urls, directory, checksums=None, processes=4, session=None, **kwargs):
+    """Download urls into directory, processes at a time, checking each file
+    against checksums[checksum_key(file name)]. A file without a checksum is
+    downloaded unchecked, with a warning unless checksums is None. Returns the
+    locations of the files, in the order of urls."""
+    session = session or make_session(processes)
+    url_checksums = []
+    for url in urls:
+        checksum = None
+        if checksums is not None:
+            checksum = checksums.get(checksum_key(urlparse(url).path.split('/')[-1]))
+            if checksum is None:
+                logger.warning('%s: no checksum, it will not be verified', url)
+        url_checksums.append((url, checksum))
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(download_file, session, url, directory, checksum=checksum, **kwargs)
+            for url, checksum in url_checksums
+        ]
+        return [future.result() for future in futures]
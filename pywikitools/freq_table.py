@@ -0,0 +1,111 @@
+"""Compact binary frequency tables, which can be memory-mapped.
+
+The layout is a fixed header followed by fixed-width little-endian arrays
+and a blob with the UTF-8 strings, sorted and concatenated:
+
+    magic       8 bytes, b'SPFREQ01'
+    n           uint64, number of entries
+    total       uint64, sum of all frequencies
+    blob_size   uint64
+    offsets     int64[n + 1], start of each string in the blob
+    freqs       int64[n]
+    doc_freqs   int64[n]
+    blob        blob_size bytes
+
+training/word_freqs.py writes these tables, and training/init.py reads them.
+"""
+from __future__ import unicode_literals
+
+from array import array
+import mmap
+import os
+import shutil
+import struct
+
+import numpy
+
+MAGIC = b'SPFREQ01'
+HEADER = struct.Struct('<8sQQQ')
+
+
+def is_freq_table(loc):
+    with open(loc, 'rb') as file_:
+        return file_.read(len(MAGIC)) == MAGIC
+
+
+def write_freq_table(loc, rows):
+    """Write (freq, doc_freq, word) rows, sorted by word, as a frequency table.
+    The strings are streamed to a temporary file, so only the fixed-width
+    columns are held in memory."""
+    offsets = array('q', [0])
+    freqs = array('q')
+    doc_freqs = array('q')
+    total = 0
+    prev = None
+    blob_loc = loc + '.blob'
+    tmp_loc = loc + '.tmp'
+    try:
+        with open(blob_loc, 'wb') as blob:
+            for freq, doc_freq, word in rows:
+                if prev is not None and word <= prev:
+                    raise ValueError("Frequency table rows must be sorted by word, "
+                                     "without duplicates: %r after %r" % (word, prev))
+                prev = word
+                data = word.encode('utf8')
+                blob.write(data)
+                offsets.append(offsets[-1] + len(data))
+                freqs.append(freq)
+                doc_freqs.append(doc_freq)
+                total += freq
+        with open(tmp_loc, 'wb') as file_:
+            file_.write(HEADER.pack(MAGIC, len(freqs), total, offsets[-1]))
+            for column in (offsets, freqs, doc_freqs):
+                file_.write(numpy.asarray(column, dtype='<i8').tobytes())
+            with open(blob_loc, 'rb') as blob:
+                shutil.copyfileobj(blob, file_)
+        os.rename(tmp_loc, loc)
+    finally:
+        os.unlink(blob_loc)
+
+
+class FreqTable(object):
+    """Read-only view of a frequency table. The columns are numpy arrays
+    backed by a memory map of the file, so nothing is copied up front."""
+    def __init__(self, loc):
+        with open(loc, 'rb') as file_:
+            self._mmap = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a frequency table" % loc)
+        magic, n, self.total, blob_size = HEADER.unpack_from(self._mmap, 0)
+        start = HEADER.size
+        self.offsets = numpy.frombuffer(self._mmap, dtype='<i8', count=n + 1, offset=start)
+        start += 8 * (n + 1)
+        self.freqs = numpy.frombuffer(self._mmap, dtype='<i8', count=n, offset=start)
+        start += 8 * n
+        self.doc_freqs = numpy.frombuffer(self._mmap, dtype='<i8', count=n, offset=start)
+        self._blob_start = start + 8 * n
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def string(self, i):
+        start = self._blob_start + int(self.offsets[i])
+        end = self._blob_start + int(self.offsets[i + 1])
+        return self._mmap[start:end].decode('utf8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield int(self.freqs[i]), int(self.doc_freqs[i]), self.string(i)
+
+    def index(self, word):
+        """Binary search for word, returning its row or -1."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.string(lo) == word:
+            return lo
+        return -1
@@ -0,0 +1,201 @@
+"""Random access to Wikipedia multistream dumps.
+
+A pages-articles-multistream.xml.bz2 dump is a concatenation of bz2 streams of
+100 pages each, after a first stream with the <siteinfo> header. The
+matching index.txt.bz2 has a line offset:pageid:title for every page, where
+offset is the byte offset of the stream the page is in. With the index, a
+page is read by decompressing a single stream, and a set of pages by
+decompressing only the streams they're in, spread over a process pool.
+"""
+import bz2
+import functools
+import multiprocessing
+import os
+import re
+from io import BytesIO
+
+import numpy as np
+
+from bz2_blocks import BZ2BlockFile, decompress_range
+from sift_wiki import extract_pages
+
+FOOTER = b'</mediawiki>'
+RE_DUMP_NAME = re.compile(r'multistream(\d*)\.xml')
+
+
+def index_location(dump_loc):
+    # enwiki-latest-pages-articles-multistream.xml.bz2
+    # -> enwiki-latest-pages-articles-multistream-index.txt.bz2, and
+    # enwiki-latest-pages-articles-multistream1.xml-p1p41242.bz2
+    # -> enwiki-latest-pages-articles-multistream-index1.txt-p1p41242.bz2
+    directory, name = os.path.split(dump_loc)
+    return os.path.join(directory, RE_DUMP_NAME.sub(r'multistream-index\1.txt', name))
+
+
+class MultistreamIndex(object):
+    """The offset:pageid:title lines of a multistream index, as arrays of
+    stream offsets and page ids, sorted by page id, and a list of titles. The
+    dict from titles to rows is only built on the first lookup by title."""
+    def __init__(self, loc):
+        offsets = []
+        pageids = []
+        titles = []
+        with bz2.open(loc, 'rt', encoding='utf8') as file_:
+            for line in file_:
+                # titles can contain colons, offsets and ids can't
+                offset, pageid, title = line.rstrip('\n').split(':', 2)
+                offsets.append(int(offset))
+                pageids.append(int(pageid))
+                titles.append(title)
+        pageids = np.array(pageids, dtype='int64')
+        order = np.argsort(pageids, kind='mergesort')
+        self.pageids = pageids[order]
+        self.offsets = np.array(offsets, dtype='int64')[order]
+        self.titles = [titles[i] for i in order.tolist()]
+        self.stream_offsets = np.unique(self.offsets)
+        self._rows_by_title = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    def row_of_id(self, pageid):
+        row = int(np.searchsorted(self.pageids, pageid))
+        if row == len(self.pageids) or self.pageids[row] != pageid:
+            raise KeyError(pageid)
+        return row
+
+    def row_of_title(self, title):
+        if self._rows_by_title is None:
+            self._rows_by_title = dict((title, row) for row, title in enumerate(self.titles))
+        return self._rows_by_title[title]
+
+    def rows_in_id_range(self, start, end):
+        """Rows of the pages with start <= pageid < end."""
+        return np.arange(np.searchsorted(self.pageids, start),
+                         np.searchsorted(self.pageids, end))
+
+
+def read_pages(loc, header, start, end, filter_namespaces=False, parser='etree'):
+    """Decompress the streams between byte offsets start and end, and parse
+    the pages in them. The streams are fragments of the dump, so they're
+    parsed between its header and a closing tag."""
+    data = decompress_range((loc, start, end))
+    if data.rstrip().endswith(FOOTER):
+        data = data.rstrip()[:-len(FOOTER)]
+    xml = BytesIO(header + data + FOOTER)
+    return list(extract_pages(xml, filter_namespaces=filter_namespaces, parser=parser))
+
+
+def _extract_range(process, loc, header, pageids, filter_namespaces, parser, byte_range):
+    start, end = byte_range
+    results = []
+    for title, text, pageid in read_pages(loc, header, start, end,
+                                          filter_namespaces=filter_namespaces, parser=parser):
+        if pageids is None or int(pageid) in pageids:
+            results.append(process((title, text, pageid)))
+    return results
+
+
+class MultistreamDump(object):
+    """A multistream dump and its index, see the module docstring."""
+    def __init__(self, loc, index_loc=None, parser='etree'):
+        self.loc = loc
+        self.index = MultistreamIndex(index_loc or index_location(loc))
+        self.parser = parser
+        self.size = os.path.getsize(loc)
+        self._header = None
+
+    @property
+    def header(self):
+        """The <mediawiki> opening tag and the <siteinfo>, which are in the
+        stream before the first page."""
+        if self._header is None:
+            first = int(self.index.stream_offsets[0]) if len(self.index) else self.size
+            self._header = decompress_range((self.loc, 0, first))
+        return self._header
+
+    def stream_end(self, offset):
+        i = int(np.searchsorted(self.index.stream_offsets, offset, side='right'))
+        if i < len(self.index.stream_offsets):
+            return int(self.index.stream_offsets[i])
+        return self.size
+
+    def _get_row(self, row):
+        offset = int(self.index.offsets[row])
+        pageid = str(self.index.pageids[row])
+        for page in read_pages(self.loc, self.header, offset, self.stream_end(offset),
+                               parser=self.parser):
+            if page[2] == pageid:
+                return page
+        raise KeyError(pageid)
+
+    def get(self, title=None, pageid=None):
+        """Return (title, text, pageid) of a page, by title or page id,
+        decompressing only the stream it's in."""
+        if pageid is not None:
+            return self._get_row(self.index.row_of_id(int(pageid)))
+        return self._get_row(self.index.row_of_title(title))
+
+    def rows(self, titles=None, pageids=None, id_range=None):
+        """Rows of the index for the given titles, page ids or (start, end)
+        range of page ids, or all the rows if none are given. Titles and ids
+        that aren't in the index are skipped."""
+        if titles is None and pageids is None and id_range is None:
+            return np.arange(len(self.index))
+        rows = []
+        for title in titles or ():
+            try:
+                rows.append(self.index.row_of_title(title))
+            except KeyError:
+                pass
+        for pageid in pageids or ():
+            try:
+                rows.append(self.index.row_of_id(int(pageid)))
+            except KeyError:
+                pass
+        rows = np.array(rows, dtype='int64')
+        if id_range is not None:
+            rows = np.concatenate([rows, self.index.rows_in_id_range(*id_range)])
+        return np.unique(rows)
+
+    def ranges(self, rows, chunk_bytes=1 << 22):
+        """Byte ranges covering the streams of rows. Streams that follow each
+        other in the file are merged into ranges of up to chunk_bytes, so each
+        worker gets a fair amount of work, and a subset of pages never
+        decompresses more than the streams it's in."""
+        offsets = np.unique(self.index.offsets[rows]).tolist()
+        ranges = []
+        for offset in offsets:
+            end = self.stream_end(offset)
+            if ranges and ranges[-1][1] == offset and ranges[-1][1] - ranges[-1][0] < chunk_bytes:
+                ranges[-1][1] = end
+            else:
+                ranges.append([offset, end])
+        return [tuple(byte_range) for byte_range in ranges]
+
+    def extract(self, process, rows=None, processes=None, chunk_bytes=1 << 22,
+                filter_namespaces=False):
+        """Yield process((title, text, pageid)) for the pages of rows, or of
+        the whole dump. Each worker seeks to its own byte range, decompresses
+        and parses it, and runs process over the pages, which must be a
+        picklable module-level function. Results come in any order."""
+        if rows is None:
+            pageids = None
+            rows = np.arange(len(self.index))
+        else:
+            pageids = set(self.index.pageids[rows].tolist())
+        work = functools.partial(_extract_range, process, self.loc, self.header, pageids,
+                                 filter_namespaces, self.parser)
+        pool = multiprocessing.Pool(processes or max(1, multiprocessing.cpu_count() - 1))
+        try:
+            for results in pool.imap_unordered(work, self.ranges(rows, chunk_bytes)):
+                for result in results:
+                    yield result
+        finally:
+            pool.terminate()
+
+    def open(self, n_procs=None):
+        """The whole dump as a file, decompressed in parallel, using the
+        stream offsets of the index instead of scanning the file for them."""
+        offsets = [0] + [offset for offset in self.index.stream_offsets.tolist() if offset > 0]
+        return BZ2BlockFile(self.loc, n_procs=n_procs, offsets=offsets)
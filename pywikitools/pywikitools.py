@@ -1,24 +1,27 @@
-import bz2
+import functools
 import multiprocessing
 import os
 import uuid
 
 import click
-import re
 import logging
 
-import numpy as np
-import requests
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
 from gensim.corpora import Dictionary
 from gensim.corpora import MmCorpus
 from gensim.corpora import WikiCorpus
-from gensim.corpora.wikicorpus import extract_pages
-from gensim.utils import chunkize
 from lxml import html
 
-from sift_wiki import filter_wiki
+from bow_counts import mm_frequencies, write_freqs
+from bz2_blocks import open_bz2
+from downloader import download_files, dump_links, fetch_checksums, make_session
+from freq_table import write_freq_table
+from multistream import MultistreamDump
+from shards import ShardWriter
+from sift_wiki import ENGINES, extract_pages, get_cleaner, pop_stats
+from wiki_freqs import FreqCounter, count_words, tokenize_article
+from wiki_pipeline import CleaningPipeline
 
 logger = logging.getLogger(__name__)
 logging.basicConfig()
@@ -27,19 +30,6 @@ logging.root.setLevel(level=logging.INFO)
 WIKIDL_BASE = "https://dumps.wikimedia.org/"
 
 
-def download_file(url, directory):
-    """Utility function to save big files"""
-    local_filename = urlparse(url).path.split('/')[-1]
-    fn = os.path.join(directory, local_filename)
-    # NOTE the stream=True parameter
-    r = requests.get(url, stream=True)
-    with open(fn, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
-    return fn
-
-
 @click.group()
 def cli():
     pass
@@ -48,23 +38,45 @@ def cli():
 @click.command()
 @click.option('--directory', default='dl_latest', type=click.Path(exists=True), help='directory download output, you need to create if it does not exist')
 @click.option('--language', default='en', prompt=True, help='language you want to get')
-def download(directory, language):
-    """Download wikipedia articles in dl_latest folder, you need to create it"""
+@click.option('--multistream', is_flag=True,
+              help='download the multistream dump and its index, for random access to pages')
+@click.option('--parts', is_flag=True,
+              help='with --multistream, download the dump in parts, with an index each, '
+                   'instead of in one file')
+@click.option('--processes', default=2,
+              help='number of files downloaded at once, dumps.wikimedia.org allows 2 connections')
+@click.option('--verify/--no-verify', default=True,
+              help='check the files against the published md5 and sha1 sums')
+def download(directory, language, multistream, parts, processes, verify):
+    """Download wikipedia articles in dl_latest folder, you need to create it
+
+    Partial downloads are resumed when the command is run again."""
     base_lang = language + "wiki/latest"
     url = urljoin(WIKIDL_BASE, base_lang)
-    page = requests.get(url)
+    session = make_session(processes)
+    page = session.get(url)
     webpage = html.fromstring(page.content)
     all_links = webpage.xpath('//a/@href')
     print(all_links)
-    for link in all_links:
-        # https://dumps.wikimedia.org/frwiki/latest/frwiki-latest-pages-articles1.xml-p000000003p000412300.bz2
-        pattern = language + "wiki-latest-pages-articles\d+.xml-p\d*p\d*.bz2$"
-        if re.match(pattern=pattern, string=link):
-            url_dl = url + '/' + link
-            download_file(url_dl, directory)
+    layout = 'articles'
+    if multistream:
+        layout = 'multistream_parts' if parts else 'multistream'
+    elif parts:
+        raise click.UsageError('--parts goes with --multistream')
+    urls = [url + '/' + link for link in dump_links(all_links, language, layout)]
+    checksums = fetch_checksums(session, url, language + 'wiki-latest') if verify else None
+    download_files(urls, directory, checksums=checksums, processes=processes, session=session)
 
 DEFAULT_DICT_SIZE = 100000
 
+
+def dump_files(input_directory):
+    """The names of the bz2 dumps in input_directory, without the multistream
+    indexes, the .streams files of bz2_blocks or partial downloads."""
+    return sorted(name for name in os.listdir(input_directory)
+                  if name.endswith('.bz2') and '-index' not in name)
+
+
 @click.command()
 @click.option('--input_directory', '-di', default='dl_latest', type=click.Path(exists=True),
               help='directory input of wiki bz2 files')
@@ -75,18 +87,7 @@ DEFAULT_DICT_SIZE = 100000
 @click.option('--lemmatize', default=False)
 @click.option('--default_disk_size', default=DEFAULT_DICT_SIZE)
 def extract(input_directory, output_directory, language, lemmatize, default_disk_size):
-    filelist = os.listdir(input_directory)
-    # used for quick debug, short bz2 extract
-    # create it like that :
-    # cp articles1 articles0
-    # vim articles0
-    # G to look for # of lines, ex 12 345 334
-    # got to about 10% of doc with 1 234 533gg
-    # find next </page> tag
-    # enter visual mode v, go to en G, go up one line k to keep wikimedia tag and D to delete
-    # wait, save :wq, wait, remove .un file that is big ! you now have a articles0.bz2 file that is big enough for testing but small
-    # enough to not last for hours
-    filelist = ['/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/dl_latest/frwiki-latest-pages-articles0.xml-p000000003p000412300.bz2']
+    filelist = dump_files(input_directory)
     for file in filelist:
         if os.path.exists(os.path.join(input_directory, file)):
             filename, file_extension = os.path.splitext(os.path.basename(file))
@@ -110,8 +111,8 @@ def my_process_article(args):
     """
     Parse a wikipedia article, returning its content as a file without all the garbage
     """
-    text, lemmatize, title, pageid = args
-    text = filter_wiki(text)
+    text, lemmatize, title, pageid, engine, language = args
+    text = get_cleaner(language).filter_wiki(text, engine=engine)
     result = text
     # if lemmatize:
     #     result = utils.lemmatize(text)
@@ -120,6 +121,48 @@ def my_process_article(args):
     return result, title, pageid
 
 
+def clean_page(page, engine='regex', language='en'):
+    title, text, pageid = page
+    return my_process_article((text, False, title, pageid, engine, language))
+
+
+class ArticleFiles(object):
+    """Write each article to its own file in directory, named after its title."""
+    def __init__(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+
+    def write(self, result):
+        tokens, title, pageid = result
+        with open(os.path.join(self.directory, title.replace('/','_')), 'w') as f:
+            f.write(tokens)
+
+    def close(self):
+        pass
+
+
+def open_article_writer(output_directory, output_format, shard_mb, compression):
+    if output_format == 'files':
+        return ArticleFiles(os.path.join(output_directory, 'text'))
+    return ShardWriter(os.path.join(output_directory, 'shards'), shard_mb=shard_mb,
+                       compression=compression)
+
+
+def output_options(command):
+    """The options of the commands that write extracted articles."""
+    options = [
+        click.option('--output_format', default='shards', type=click.Choice(['shards', 'files']),
+                     help='JSON lines shards with an index, or a file per article'),
+        click.option('--shard_mb', default=64, help='size of the shards, in MB'),
+        click.option('--compression', default='none', type=click.Choice(['none', 'gzip', 'zstd']),
+                     help='compression of the shards, zstd needs the zstandard package'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
 @click.command()
 @click.option('--input_directory', '-di', default='dl_latest', type=click.Path(exists=True),
               help='directory input of wiki bz2 files')
@@ -127,54 +170,177 @@ def my_process_article(args):
               help='directory extraction output')
 @click.option('--lemmatize', default=False)
 @click.option('--default_disk_size', default=DEFAULT_DICT_SIZE)
-def extract_articles(input_directory, output_directory, lemmatize, default_disk_size):
-    filelist = os.listdir(input_directory)
-    # used for quick debug, short bz2 extract
-    filelist = ['/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/dl_latest/frwiki-latest-pages-articles0.xml-p000000003p000412300.bz2']
+@click.option('--bz2_processes', default=1,
+              help='number of processes decompressing multistream bz2 dumps')
+@click.option('--processes', default=max(1, multiprocessing.cpu_count() - 1),
+              help='number of processes cleaning articles')
+@click.option('--batch_size', default=1 << 20,
+              help='characters of article text sent to a worker at once')
+@click.option('--engine', default='regex', type=click.Choice(sorted(ENGINES)),
+              help='markup stripping engine, see bench_markup.py')
+@click.option('--language', default='en',
+              help='language of the dump, for the local names of File: and Image: links')
+@click.option('--parser', default='lxml', type=click.Choice(['etree', 'lxml']),
+              help='XML parser, see bench_extract_pages.py')
+@output_options
+def extract_articles(input_directory, output_directory, lemmatize, default_disk_size, bz2_processes,
+                     processes, batch_size, engine, language, parser, output_format, shard_mb,
+                     compression):
+    filelist = dump_files(input_directory)
+    writer = open_article_writer(output_directory, output_format, shard_mb,
+                                 None if compression == 'none' else compression)
     for file in filelist:
         if os.path.exists(os.path.join(input_directory, file)):
             filename, file_extension = os.path.splitext(os.path.basename(file))
             # wiki = WikiCorpus(os.path.join(input_directory, file))
             # wiki.save(os.path.join(output_directory, filename + '_corpus.pkl.bz2'))
             inp = os.path.join(input_directory, file)
-            texts = ((text, lemmatize, title, pageid) for title, text, pageid in extract_pages(bz2.BZ2File(inp)))
-            processes = max(1, multiprocessing.cpu_count() - 1)
-            pool = multiprocessing.Pool(processes)
-            # process the corpus in smaller chunks of docs, because multiprocessing.Pool
-            # is dumb and would load the entire input into RAM at once...
-            for group in chunkize(texts, chunksize=10 * processes, maxsize=1):
-                for tokens, title, pageid in pool.map(my_process_article, group):  # chunksize=10):
-                    with open(os.path.join(
-                            '/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/extract_output/text',
-                            title.replace('/','_')), 'w') as f:
+            texts = ((text, lemmatize, title, pageid, engine, language) for title, text, pageid in
+                     extract_pages(open_bz2(inp, n_procs=bz2_processes), parser=parser))
+            pipeline = CleaningPipeline(my_process_article, writer.write,
+                                        processes=processes, target_size=batch_size,
+                                        stats=pop_stats)
+            pipeline.run(texts)
+    writer.close()
+
+
+@click.command()
+@click.option('--dump', '-d', required=True, type=click.Path(exists=True),
+              help='multistream dump, with its index next to it')
+@click.option('--index', default=None, type=click.Path(exists=True),
+              help='multistream index, if it is not next to the dump')
+@click.option('--title', default=None, help='title of the page')
+@click.option('--pageid', default=None, type=int, help='id of the page')
+@click.option('--raw', is_flag=True, help='print the wikitext instead of the clean text')
+@click.option('--engine', default='regex', type=click.Choice(sorted(ENGINES)))
+@click.option('--language', default='en')
+def page(dump, index, title, pageid, raw, engine, language):
+    """Print one page of a multistream dump, by title or id"""
+    if title is None and pageid is None:
+        raise click.UsageError('give a --title or a --pageid')
+    dump = MultistreamDump(dump, index_loc=index)
+    try:
+        title, text, pageid = dump.get(title=title, pageid=pageid)
+    except KeyError:
+        raise click.ClickException('page not found')
+    if not raw:
+        text, title, pageid = clean_page((title, text, pageid), engine=engine, language=language)
+    click.echo(text)
+
 
-                        f.write(tokens)
-            pool.terminate()
+@click.command()
+@click.option('--dump', '-d', required=True, type=click.Path(exists=True),
+              help='multistream dump, with its index next to it')
+@click.option('--index', default=None, type=click.Path(exists=True),
+              help='multistream index, if it is not next to the dump')
+@click.option('--titles', default=None, type=click.File('r', encoding='utf8'),
+              help='file with the titles of the pages to extract, one per line')
+@click.option('--id_range', default=None,
+              help='ids of the pages to extract, as start-end, end excluded')
+@click.option('--processes', default=max(1, multiprocessing.cpu_count() - 1),
+              help='number of processes decompressing and cleaning pages')
+@click.option('--chunk_bytes', default=1 << 22,
+              help='compressed bytes of consecutive streams read by a worker at once')
+@click.option('--engine', default='regex', type=click.Choice(sorted(ENGINES)))
+@click.option('--language', default='en')
+@click.option('--parser', default='lxml', type=click.Choice(['etree', 'lxml']))
+@click.option('--output_directory', '-do', default='extract_output', type=click.Path(exists=True),
+              help='directory extraction output')
+@output_options
+def extract_multistream(dump, index, titles, id_range, processes, chunk_bytes, engine, language,
+                        parser, output_directory, output_format, shard_mb, compression):
+    """Extract pages of a multistream dump in parallel, each worker reading
+    its own byte range. With --titles or --id_range, only the streams with
+    those pages are decompressed."""
+    dump = MultistreamDump(dump, index_loc=index, parser=parser)
+    rows = None
+    if titles is not None or id_range is not None:
+        if id_range is not None:
+            id_range = tuple(int(pageid) for pageid in id_range.split('-'))
+        titles = [line.strip() for line in titles] if titles is not None else None
+        rows = dump.rows(titles=titles, id_range=id_range)
+    process = functools.partial(clean_page, engine=engine, language=language)
+    writer = open_article_writer(output_directory, output_format, shard_mb,
+                                 None if compression == 'none' else compression)
+    n_pages = 0
+    for result in dump.extract(process, rows=rows, processes=processes, chunk_bytes=chunk_bytes):
+        writer.write(result)
+        n_pages += 1
+    writer.close()
+    logger.info('{} pages extracted'.format(n_pages))
+
+
+@click.command()
+@click.option('--wordids', required=True, type=click.Path(exists=True),
+              help='id to word mapping written by extract, <name>_wordids.txt.bz2')
+@click.option('--bow', required=True, type=click.Path(exists=True),
+              help='bag-of-words corpus written by extract, <name>_bow.mm')
+@click.option('--output', default='extract_output/freq.txt', type=click.Path(),
+              help='frequencies in the freq, doc_freq, word format of init.py')
+@click.option('--table', default=None, type=click.Path(),
+              help='also write a binary frequency table for init.py')
+@click.option('--block_mb', default=64, help='MB of the corpus parsed at once')
+def frequency(wordids, bow, output, table, block_mb):
+    """Term and document frequencies of the words of an extracted corpus"""
+    dictionary = Dictionary.load_from_text(wordids)
+    cw, cd = mm_frequencies(bow, block_bytes=block_mb << 20)
+    logger.info('{} terms counted'.format(len(cw)))
+    words = [dictionary[i] for i in range(len(cw))]
+    write_freqs(output, cw, cd, words)
+    if table:
+        order = sorted(range(len(words)), key=lambda i: words[i])
+        write_freq_table(table, ((int(cw[i]), int(cd[i]), words[i]) for i in order))
 
 
 @click.command()
-def frequency():
-    path = '/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/extract_output/frwiki-latest-pages-articles1.xml-p000000003p000412300_wordids.txt.bz2'
-    dictionary = Dictionary.load_from_text(path)
-    mm = MmCorpus('/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/extract_output/frwiki-latest-pages-articles1.xml-p000000003p000412300_bow.mm')
-    cw = np.zeros(mm.num_terms)
-    cd = np.zeros(mm.num_terms)
-    warn = int(1/10 * mm.num_docs)
-    for count_doc, doc in enumerate(mm):
-        if count_doc % warn == 0:
-            logger.info('{} over {}'.format(count_doc, mm.num_docs))
-        for (word_id, word_freq) in doc:
-            cw[word_id] += word_freq
-            cd[word_id] += 1
-    with open('/home/lotso/PycharmProjects/spacy-dev-resources/pywikitools/extract_output/freq.txt', 'w') as output:
-        for i in range(mm.num_terms):
-            output.write(str(cw[i])+'\t'+str(cd[i])+'\t'+dictionary[i]+'\n')
+@click.argument('dumps', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--output', default='extract_output/freq.txt', type=click.Path(),
+              help='frequencies in the freq, doc_freq, word format of init.py')
+@click.option('--table', default=None, type=click.Path(),
+              help='also write a binary frequency table for init.py')
+@click.option('--language', default='en',
+              help='language of the dump, for the spaCy tokenizer and the File: and Image: links')
+@click.option('--no_below', default=20, help='drop words in fewer articles than this')
+@click.option('--keep_n', default=DEFAULT_DICT_SIZE,
+              help='keep this many words, those in the most articles, 0 to keep all')
+@click.option('--bz2_processes', default=1,
+              help='number of processes decompressing multistream bz2 dumps')
+@click.option('--processes', default=max(1, multiprocessing.cpu_count() - 1),
+              help='number of processes cleaning and tokenizing articles')
+@click.option('--batch_size', default=1 << 20,
+              help='characters of article text sent to a worker at once')
+@click.option('--engine', default='regex', type=click.Choice(sorted(ENGINES)),
+              help='markup stripping engine, see bench_markup.py')
+@click.option('--parser', default='lxml', type=click.Choice(['etree', 'lxml']),
+              help='XML parser, see bench_extract_pages.py')
+def wiki_frequency(dumps, output, table, language, no_below, keep_n, bz2_processes, processes,
+                   batch_size, engine, parser):
+    """Word frequencies of dumps in one pass, without the bag-of-words corpus
+    of extract: the articles are cleaned, tokenized and counted as they're read"""
+    counter = FreqCounter()
+    pipeline = CleaningPipeline(tokenize_article, counter.write, processes=processes,
+                                target_size=batch_size, combine=count_words, stats=pop_stats)
+    for dump in dumps:
+        texts = ((text, language, engine) for title, text, pageid in
+                 extract_pages(open_bz2(dump, n_procs=bz2_processes), filter_namespaces=('0',),
+                               parser=parser) if text)
+        pipeline.run(texts)
+    rows = counter.prune(no_below=no_below, keep_n=keep_n or None)
+    logger.info('{} of {} words kept'.format(len(rows), len(counter.term_freqs)))
+    words = [word for word, freq, doc_freq in rows]
+    write_freqs(output, [freq for word, freq, doc_freq in rows],
+                [doc_freq for word, freq, doc_freq in rows], words)
+    if table:
+        write_freq_table(table, ((freq, doc_freq, word) for word, freq, doc_freq in sorted(rows)))
 
 
 cli.add_command(download)
 cli.add_command(extract)
 cli.add_command(frequency)
+cli.add_command(wiki_frequency)
 cli.add_command(extract_articles)
+cli.add_command(page)
+cli.add_command(extract_multistream)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,210 @@
+"""Write extracted articles to a few large shards instead of a file each.
+
+Articles are written as JSON lines, {"title": ..., "pageid": ..., "text": ...},
+to shards of about shard_mb megabytes, optionally compressed with gzip or
+zstd. Compressed shards are written in blocks, each an independent gzip
+member or zstd frame, so that a reader can start decompressing at any block.
+A sidecar index.tsv has a line per article:
+
+    title   pageid  shard   offset  inner
+
+where offset is the position of the block in the shard file and inner the
+position of the article's line in the decompressed block. Uncompressed shards
+have a block per line. The index is only renamed into place once the writer
+is closed, so a directory with an index.tsv is complete.
+
+training/word_vectors.py trains on shards with ShardReader.
+"""
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = 'index.tsv'
+EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+def is_shard_directory(directory):
+    return os.path.exists(os.path.join(directory, INDEX_NAME))
+
+
+def _check_compression(compression):
+    if compression not in EXTENSIONS:
+        raise ValueError("compression must be one of %s" % sorted(EXTENSIONS, key=str))
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError("zstd shards need the zstandard package")
+
+
+def compress_block(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    elif compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+class ShardWriter(object):
+    """Write (text, title, pageid) results, as returned by the article
+    cleaning functions, to shards in directory."""
+    def __init__(self, directory, shard_mb=64, compression=None, block_kb=1024,
+                 prefix='articles'):
+        _check_compression(compression)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.shard_bytes = shard_mb << 20
+        self.block_bytes = block_kb << 10
+        self.compression = compression
+        self.prefix = prefix
+        self.n_shards = 0
+        self.n_articles = 0
+        self._shard = None
+        self._shard_name = None
+        self._block = []
+        self._block_size = 0
+        self._block_entries = []
+        self._index = io.open(os.path.join(directory, INDEX_NAME + '.tmp'), 'w', encoding='utf8')
+
+    def _open_shard(self):
+        self._shard_name = '%s-%05d%s' % (self.prefix, self.n_shards, EXTENSIONS[self.compression])
+        self._shard = open(os.path.join(self.directory, self._shard_name), 'wb')
+        self.n_shards += 1
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        if self._shard is None:
+            self._open_shard()
+        offset = self._shard.tell()
+        self._shard.write(compress_block(b''.join(self._block), self.compression))
+        for title, pageid, inner in self._block_entries:
+            self._index.write('%s\t%s\t%s\t%d\t%d\n' % (title, pageid, self._shard_name, offset, inner))
+        self._block = []
+        self._block_size = 0
+        self._block_entries = []
+        if self._shard.tell() >= self.shard_bytes:
+            self._shard.close()
+            self._shard = None
+
+    def write(self, result):
+        text, title, pageid = result
+        line = json.dumps({'title': title, 'pageid': pageid, 'text': text},
+                          ensure_ascii=False).encode('utf8') + b'\n'
+        self._block_entries.append((title, pageid, self._block_size))
+        self._block.append(line)
+        self._block_size += len(line)
+        self.n_articles += 1
+        if self.compression is None or self._block_size >= self.block_bytes:
+            self._flush_block()
+
+    def close(self):
+        self._flush_block()
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        self._index.close()
+        os.rename(os.path.join(self.directory, INDEX_NAME + '.tmp'),
+                  os.path.join(self.directory, INDEX_NAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _decompress_block(file_, compression, chunk_size=1 << 16):
+    # Read a single gzip member or zstd frame, starting at the current position.
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    chunks = []
+    while not decompressor.eof:
+        data = file_.read(chunk_size)
+        if not data:
+            break
+        chunks.append(decompressor.decompress(data))
+    return b''.join(chunks)
+
+
+class ShardReader(object):
+    """Read the articles in a directory of shards, sequentially, or one at a
+    time by title or page id, through the index."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.shards = []
+        self._by_title = None
+        self._by_pageid = None
+        with io.open(os.path.join(directory, INDEX_NAME), 'r', encoding='utf8') as file_:
+            for line in file_:
+                shard = line.split('\t', 3)[2]
+                if not self.shards or self.shards[-1] != shard:
+                    self.shards.append(shard)
+
+    @staticmethod
+    def _compression(shard):
+        for compression, extension in EXTENSIONS.items():
+            if compression is not None and shard.endswith(extension):
+                return compression
+        return None
+
+    def _open(self, shard):
+        loc = os.path.join(self.directory, shard)
+        compression = self._compression(shard)
+        if compression == 'gzip':
+            return gzip.open(loc, 'rb')
+        elif compression == 'zstd':
+            _check_compression(compression)
+            return zstandard.ZstdDecompressor().stream_reader(open(loc, 'rb'),
+                                                              read_across_frames=True)
+        return open(loc, 'rb')
+
+    def __iter__(self):
+        """Yield the articles as dicts, in the order they were written."""
+        for shard in self.shards:
+            with io.TextIOWrapper(self._open(shard), encoding='utf8') as file_:
+                for line in file_:
+                    yield json.loads(line)
+
+    def iter_texts(self):
+        for article in self:
+            yield article['text']
+
+    def _load_index(self):
+        self._by_title = {}
+        self._by_pageid = {}
+        with io.open(os.path.join(self.directory, INDEX_NAME), 'r', encoding='utf8') as file_:
+            for line in file_:
+                title, pageid, shard, offset, inner = line.rstrip('\n').split('\t')
+                entry = (shard, int(offset), int(inner))
+                self._by_title[title] = entry
+                self._by_pageid[pageid] = entry
+
+    def get(self, title=None, pageid=None):
+        """Return the article with this title or page id as a dict, reading
+        only its block. Raises KeyError if it's not in the shards."""
+        if self._by_title is None:
+            self._load_index()
+        if pageid is not None:
+            shard, offset, inner = self._by_pageid[str(pageid)]
+        else:
+            shard, offset, inner = self._by_title[title]
+        compression = self._compression(shard)
+        with open(os.path.join(self.directory, shard), 'rb') as file_:
+            file_.seek(offset)
+            if compression is None:
+                line = file_.readline()
+            else:
+                _check_compression(compression)
+                block = _decompress_block(file_, compression)
+                line = block[inner:block.index(b'\n', inner) + 1]
+        return json.loads(line.decode('utf8'))
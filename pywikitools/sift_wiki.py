@@ -5,7 +5,17 @@
 #   Lars Buitinck <larsmans@gmail.com>
 
 import re
-from xml.etree.cElementTree import iterparse  # LXML isn't faster, so let's go with the built-in solution
+import time
+try:
+    from xml.etree.cElementTree import iterparse  # LXML isn't faster, so let's go with the built-in solution
+except ImportError:
+    # cElementTree was removed in Python 3.9, ElementTree uses the C parser anyway
+    from xml.etree.ElementTree import iterparse
+try:
+    # only needed for extract_pages(parser='lxml')
+    from lxml.etree import iterparse as lxml_iterparse
+except ImportError:
+    lxml_iterparse = None
 
 from html.entities import name2codepoint
 
@@ -40,102 +50,294 @@ RE_SECT = re.compile(r'(==+)\s*(.*?)\s*\1')
 RE_EMPTY_PARENS = re.compile(r' \(\s*\)')
 
 RE_HTML_ENT = re.compile("&#?(\w+);")
-
-def filter_wiki(raw):
+RE_LINKS = re.compile(r'<a href="(.+?)">(.+?)</a>') # links injected by remove_markup
+
+# The comments, tags and links removed by the loop in remove_markup, as one
+# alternation, so that strip_markup can remove them in a single scan.
+# Alternatives are tried in the same order as the substitutions in the loop.
+# Links are matched by their brackets only, so that nested links can be
+# resolved with a stack. The lookahead skips positions that can't start any
+# markup without trying every alternative.
+RE_STRUCTURE = re.compile(r"""
+    (?=[<\[\]])
+    (?:
+      (?P<comment>(?s:<!--.*?-->))
+    | (?P<ref>(?s:<ref([> ].*?)(</ref>|/>)))
+    | (?P<nowiki>(?s:<nowiki([> ].*?)(</nowiki>|/>)))
+    | (?P<math>(?s:<math([> ].*?)(</math>|/>)))
+    | (?P<tag>(?s:<.*?>))
+    | (?P<url>\[\w+://.*?(?:(?P<url_desc>\ .*?))?\])
+    | (?P<link_open>\[\[)
+    | (?P<link_close>\]\])
+    | (?P<empty>\[\])
+    )
+""", re.UNICODE | re.VERBOSE)
+
+# Names of the File: and Image: namespaces in each language. Most wikis accept
+# the English names too, so they're kept for every language.
+FILE_NAMESPACES = {
+    'en': ['File', 'Image'],
+    'bg': ['Файл', 'Картинка'],
+    'de': ['Datei', 'Bild'],
+    'es': ['Archivo', 'Imagen'],
+    'fr': ['Fichier'],
+    'it': ['Immagine'],
+    'nl': ['Bestand', 'Afbeelding'],
+    'pl': ['Plik', 'Grafika'],
+    'pt': ['Ficheiro', 'Arquivo', 'Imagem'],
+    'ru': ['Файл', 'Изображение'],
+    'sv': ['Fil', 'Bild'],
+}
+
+ENGINES = {
+    'regex': 'remove_markup',
+    'single_pass': 'remove_markup_single_pass',
+}
+
+def filter_wiki(raw, engine='regex'):
     """
     Filter out wiki mark-up from `raw`, leaving only text. `raw` is either unicode
-    or utf-8 encoded string.
+    or utf-8 encoded string. `engine` is 'regex' for the iterative substitutions
+    of `remove_markup`, or 'single_pass' for `remove_markup_single_pass`.
     """
-    # parsing of the wiki markup is not perfect, but sufficient for our purposes
-    # contributions to improving this code are welcome :)
-    text = to_unicode(raw, 'utf8', errors='ignore')
-    text = decode_htmlentities(text)  # '&amp;nbsp;' --> '\xa0'
-    return remove_markup(text)
+    return _default_cleaner.filter_wiki(raw, engine=engine)
 
 def remove_markup(text):
-    text = re.sub(RE_P2, "", text)
-
-    # TODO: may be desirable to extract captions for files and images and insert them back into the document
-    text = remove_template(text)
-    text = extract_tag_content(text, [
-        re.compile('\[\[[fF]ile:(.*?)(\|[^\]\[]+?)*\|'),
-        re.compile('\[\[[iI]mage:(.*?)(\|[^\]\[]+?)*\|')
-    ])
-
-    # the wiki markup is recursive (markup inside markup etc) we deal with that by removing
-    # markup in a loop, starting with inner-most expressions and working outwards as long as something changes.
-    iters = 0
-    while True:
-        old, iters = text, iters + 1
-        text = re.sub(RE_P0, "", text) # remove comments
-        text = re.sub(RE_P1, '', text) # remove footnotes
-        text = re.sub(RE_P9, "", text) # remove outside links
-        text = re.sub(RE_P10, "", text) # remove math content
-        text = re.sub(RE_P11, "", text)  # remove all remaining tags
-
-        text = re.sub(RE_P14, '', text) # remove categories
-
-        # inject links
-        text = re.sub(RE_P5, '<a href="\\2">\\3</a>', text) # remove urls, keep description
-        text = re.sub(RE_P6, '<a href="%s\\1">\\2</a>' % wikilink_prefix, text) # simplify links, keep description only
-        text = re.sub(RE_P6_ex, '<a href="%s\\1">\\1</a>' % wikilink_prefix, text)
-        # remove table markup
-        text = text.replace('||', '\n|') # each table cell on a separate line
-        text = re.sub(RE_P12, '\n', text) # remove formatting lines
-        text = re.sub(RE_P13, '\n\\3', text) # leave only cell content
-        # remove empty mark-up
-        text = text.replace('[]', '')
-
-        # formatting
-        text = re.sub(RE_BI, r"\1", text)
-        text = re.sub(RE_B, r"\1", text)
-        text = re.sub(RE_IQ, r'&quot;\1&quot;', text)
-        text = re.sub(RE_I, r'&quot;\1&quot;', text)
-        text = re.sub(RE_QQ, r"\1", text)
-
-        if old == text or iters > 2: # stop if nothing changed between two iterations or after a fixed number of iterations
-            break
+    return _default_cleaner.remove_markup(text)
 
-    text = re.sub(RE_EMPTY_PARENS, '', text) # remove empty parenthesis (usually left by stripped templates)
-    text = text.replace('[', '').replace(']', '') # promote all remaining markup to plain text
-    text = html_unescape(text.strip())
-    return text
+def remove_markup_single_pass(text):
+    return _default_cleaner.remove_markup_single_pass(text)
 
-def remove_template(s):
-    # Find the start and end position of each template by finding the opening '{{' and closing '}}'
-    n_open, n_close = 0, 0
-    starts, ends = [], []
-    in_template = False
-    prev_c = None
-    for i, c in enumerate(iter(s)):
-        if not in_template:
-            if c == '{' and c == prev_c:
-                starts.append(i - 1)
-                in_template = True
-                n_open = 1
-        if in_template:
-            if c == '{':
-                n_open += 1
-            elif c == '}':
-                n_close += 1
-            if n_open == n_close:
-                ends.append(i)
-                in_template = False
-                n_open, n_close = 0, 0
-        prev_c = c
-
-    # Remove all the templates
-    s = ''.join([s[end + 1:start] for start, end in
-                 zip(starts + [None], [-1] + ends)])
+def strip_markup(text):
+    return _default_cleaner.strip_markup(text)
 
-    return s
+def _link_text(content):
+    # what the link substitutions would leave of [[content]]
+    if content.startswith('Category:'):
+        return ''
+    if content.startswith(':'):
+        content = content[1:]
+    return content.rsplit('|', 1)[-1]
+
+class WikiCleaner(object):
+    """
+    Remove wiki markup, with the patterns for a language compiled once.
+
+    File and image links are recognised by the English namespace names and
+    by the local names for `language`, e.g. 'Fichier:' for frwiki. The time
+    spent in each pattern and the number of substitutions it made are added
+    up in `stats`, see `report`.
+    """
+    def __init__(self, language='en'):
+        self.language = language
+        names = FILE_NAMESPACES['en'] + [name for name in FILE_NAMESPACES.get(language, [])
+                                         if name not in FILE_NAMESPACES['en']]
+        # one pattern per name, applied in turn like the original File and Image ones
+        self.file_tags = [
+            (name, re.compile(r'\[\[[%s%s]%s:(.*?)(\|[^\]\[]+?)*\|' % (
+                name[0].lower(), name[0].upper(), re.escape(name[1:])), re.UNICODE))
+            for name in names
+        ]
+        self.stats = {}
+
+    def _count(self, name, seconds, hits):
+        total = self.stats.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += hits
+
+    def _sub(self, name, pattern, repl, text):
+        start = time.time()
+        text, hits = pattern.subn(repl, text)
+        self._count(name, time.time() - start, hits)
+        return text
+
+    def report(self):
+        """Return (name, seconds, hits) for each pattern, slowest first."""
+        return report_stats(self.stats)
+
+    def filter_wiki(self, raw, engine='regex'):
+        # parsing of the wiki markup is not perfect, but sufficient for our purposes
+        # contributions to improving this code are welcome :)
+        text = to_unicode(raw, 'utf8', errors='ignore')
+        text = decode_htmlentities(text)  # '&amp;nbsp;' --> '\xa0'
+        return getattr(self, ENGINES[engine])(text)
+
+    def _remove_templates_and_files(self, text):
+        text = self._sub('language links', RE_P2, "", text)
+
+        # TODO: may be desirable to extract captions for files and images and insert them back into the document
+        start = time.time()
+        text, hits = _remove_template(text)
+        self._count('templates', time.time() - start, hits)
+        for name, pattern in self.file_tags:
+            start = time.time()
+            text, hits = _extract_tag_content(text, [pattern])
+            self._count(name + ' links', time.time() - start, hits)
+        return text
+
+    def _finish(self, text):
+        text = self._sub('empty parens', RE_EMPTY_PARENS, '', text) # remove empty parenthesis (usually left by stripped templates)
+        text = text.replace('[', '').replace(']', '') # promote all remaining markup to plain text
+        text = html_unescape(text.strip())
+        return text
+
+    def _remove_tables(self, text):
+        text = text.replace('||', '\n|') # each table cell on a separate line
+        text = self._sub('table formatting', RE_P12, '\n', text) # remove formatting lines
+        text = self._sub('table cells', RE_P13, '\n\\3', text) # leave only cell content
+        return text
+
+    def _remove_formatting(self, text):
+        text = self._sub('bold italic', RE_BI, r"\1", text)
+        text = self._sub('bold', RE_B, r"\1", text)
+        text = self._sub('italic quote', RE_IQ, r'&quot;\1&quot;', text)
+        text = self._sub('italic', RE_I, r'&quot;\1&quot;', text)
+        text = self._sub('double quote', RE_QQ, r"\1", text)
+        return text
+
+    def remove_markup(self, text):
+        text = self._remove_templates_and_files(text)
+
+        # the wiki markup is recursive (markup inside markup etc) we deal with that by removing
+        # markup in a loop, starting with inner-most expressions and working outwards as long as something changes.
+        iters = 0
+        while True:
+            old, iters = text, iters + 1
+            text = self._sub('comments', RE_P0, "", text) # remove comments
+            text = self._sub('footnotes', RE_P1, '', text) # remove footnotes
+            text = self._sub('nowiki', RE_P9, "", text) # remove outside links
+            text = self._sub('math', RE_P10, "", text) # remove math content
+            text = self._sub('tags', RE_P11, "", text)  # remove all remaining tags
+
+            text = self._sub('categories', RE_P14, '', text) # remove categories
+
+            # inject links
+            text = self._sub('urls', RE_P5, '<a href="\\2">\\3</a>', text) # remove urls, keep description
+            text = self._sub('links', RE_P6, '<a href="%s\\1">\\2</a>' % wikilink_prefix, text) # simplify links, keep description only
+            text = self._sub('bare links', RE_P6_ex, '<a href="%s\\1">\\1</a>' % wikilink_prefix, text)
+            # remove table markup
+            text = self._remove_tables(text)
+            # remove empty mark-up
+            text = text.replace('[]', '')
+
+            # formatting
+            text = self._remove_formatting(text)
+
+            if old == text or iters > 2: # stop if nothing changed between two iterations or after a fixed number of iterations
+                break
+
+        return self._finish(text)
+
+    def remove_markup_single_pass(self, text):
+        """
+        Like `remove_markup`, but its substitution loop, up to three iterations of
+        about 20 regex passes, is replaced by `strip_markup`: one scan for comments,
+        tags and links, then the table and formatting passes once. Templates, files
+        and the final clean-up are the same. The output differs from `remove_markup`
+        on some pages, where the loop's repeated passes pair quotes differently or
+        treat unbalanced tags differently; see tests/test_sift_wiki.py.
+        """
+        text = self._remove_templates_and_files(text)
+        text = self.strip_markup(text)
+        return self._finish(text)
+
+    def strip_markup(self, text):
+        """
+        Strip comments, tags, links, tables and formatting from `text`. Structure
+        is removed in one left-to-right scan: the text inside a link is collected
+        on a stack and replaced once its closing brackets are found, so links can
+        nest. Formatting is removed afterwards, in the same order as remove_markup,
+        since its patterns overlap.
+        """
+        start = time.time()
+        stack = []
+        out = []
+        pos = 0
+        hits = 0
+        for match in RE_STRUCTURE.finditer(text):
+            out.append(text[pos:match.start()])
+            pos = match.end()
+            hits += 1
+            kind = match.lastgroup
+            if kind == 'url':
+                desc = match.group('url_desc')
+                if desc:
+                    out.append(desc)
+            elif kind == 'link_open':
+                stack.append(out)
+                out = []
+            elif kind == 'link_close':
+                if stack:
+                    content = ''.join(out)
+                    out = stack.pop()
+                    out.append(_link_text(content))
+                else:
+                    out.append(']]')
+            # comments, references, nowiki, math, other tags and [] are dropped
+        out.append(text[pos:])
+        # unclosed links are left as they are
+        while stack:
+            content = ''.join(out)
+            out = stack.pop()
+            out.append('[[' + content)
+        text = ''.join(out)
+        self._count('structure', time.time() - start, hits)
+        # remove table markup, once links are gone so their pipes aren't cells
+        if '|' in text or '\n!' in text:
+            text = self._remove_tables(text)
+        return self._remove_formatting(text)
+
+def remove_template(s):
+    """
+    Remove templates from `s`. A template starts at the first '{{' and ends
+    where as many '}' as '{' have been seen since its start, so templates can
+    nest. Everything from the start of an unclosed template is dropped.
+    """
+    return _remove_template(s)[0]
+
+def _remove_template(s):
+    # Returns the text and the number of outermost templates removed.
+    # Jump from brace to brace with str.find, which scans in C, instead of
+    # looping over every character in Python.
+    parts = []
+    pos = 0
+    n = 0
+    while True:
+        start = s.find('{{', pos)
+        if start == -1:
+            parts.append(s[pos:])
+            break
+        parts.append(s[pos:start])
+        n += 1
+        depth = 2
+        next_open = s.find('{', start + 2)
+        next_close = s.find('}', start + 2)
+        while next_close != -1:
+            if next_open != -1 and next_open < next_close:
+                depth += 1
+                next_open = s.find('{', next_open + 1)
+            else:
+                depth -= 1
+                if depth == 0:
+                    break
+                next_close = s.find('}', next_close + 1)
+        if next_close == -1:
+            break
+        pos = next_close + 1
+    return ''.join(parts), n
 
 def extract_tag_content(s, tags, include_content=True):
+    return _extract_tag_content(s, tags, include_content)[0]
+
+def _extract_tag_content(s, tags, include_content=True):
+    # Returns the text and the number of tags matched.
     s = s.replace(u'\u2502','|')
+    n = 0
     for t in tags:
         parts = []
         last_match_end = None
         for match in t.finditer(s):
+            n += 1
             parts.append(slice(last_match_end,match.start()))
 
             i = match.end()
@@ -160,7 +362,7 @@ def extract_tag_content(s, tags, include_content=True):
         parts.append(slice(last_match_end,None))
         s = ''.join(s[p] if type(p) is slice else p for p in parts)
 
-    return s
+    return s, n
 
 def html_unescape(text):
     def replace(m):
@@ -174,13 +376,29 @@ def html_unescape(text):
             return span
     return re.sub(RE_HTML_ENT, replace, text)
 
-def extract_pages(f, filter_namespaces=False):
+def get_namespace(tag):
+    """Returns the namespace of tag."""
+    m = re.match("^{(.*?)}", tag)
+    namespace = m.group(1) if m else ""
+    if not namespace.startswith("http://www.mediawiki.org/xml/export-"):
+        raise ValueError("%s not recognized as MediaWiki dump namespace"
+                         % namespace)
+    return namespace
+
+def extract_pages(f, filter_namespaces=False, parser='etree'):
     """
     Extract pages from a MediaWiki database dump = open file-like object `f`.
 
     Return an iterable over (str, str, str) which generates (title, content, pageid) triplets.
-
+    If `filter_namespaces` is given, pages in other namespaces have empty content.
+    `parser` is 'etree' for the built-in ElementTree, or 'lxml', which is faster
+    and keeps memory flat on large dumps, see `_extract_pages_lxml`.
     """
+    if parser == 'lxml':
+        return _extract_pages_lxml(f, filter_namespaces)
+    return _extract_pages_etree(f, filter_namespaces)
+
+def _extract_pages_etree(f, filter_namespaces=False):
     elems = (elem for _, elem in iterparse(f, events=("end",)))
 
     # We can't rely on the namespace for database dumps, since it's changed
@@ -217,6 +435,48 @@ def extract_pages(f, filter_namespaces=False):
             # ./revision/text element. The pages comprise the bulk of the
             # file, so in practice we prune away enough.
             elem.clear()
+
+def _extract_pages_lxml(f, filter_namespaces=False):
+    if lxml_iterparse is None:
+        raise ImportError("the lxml parser needs lxml to be installed")
+    # Only the end of <page> elements is reported, so the parser doesn't build
+    # event tuples for all the other elements, and the children of each page
+    # are looked at once, rather than searched for every path.
+    title_tag = text_tag = ns_tag = pageid_tag = revision_tag = None
+    for _, elem in lxml_iterparse(f, events=("end",), tag="{*}page", huge_tree=True):
+        if title_tag is None:
+            ns_mapping = {"ns": get_namespace(elem.tag)}
+            title_tag = "{%(ns)s}title" % ns_mapping
+            text_tag = "{%(ns)s}text" % ns_mapping
+            ns_tag = "{%(ns)s}ns" % ns_mapping
+            pageid_tag = "{%(ns)s}id" % ns_mapping
+            revision_tag = "{%(ns)s}revision" % ns_mapping
+
+        title = text = pageid = None
+        keep = True
+        for child in elem:
+            if child.tag == title_tag:
+                title = child.text
+            elif child.tag == ns_tag:
+                # <ns> comes before <revision>, so the text of filtered pages
+                # is never looked at
+                keep = not filter_namespaces or child.text in filter_namespaces
+            elif child.tag == pageid_tag:
+                pageid = child.text
+            elif child.tag == revision_tag and keep:
+                for rev_child in child:
+                    if rev_child.tag == text_tag:
+                        text = rev_child.text
+        yield title, text or "", pageid
+
+        # Prune the element tree, as per
+        # http://www.ibm.com/developerworks/xml/library/x-hiperfparse/
+        # The cleared pages are deleted from the root too, or it would keep
+        # an empty element for every page of the dump.
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
 _extract_pages = extract_pages  # for backward compatibility
 
 def normalise_wikilink(s):
@@ -231,16 +491,50 @@ def normalise_link(s):
     return s
 
 def extract_links(content):
-    links_re = re.compile(r'<a href="(.+?)">(.+?)</a>')
-
     links = []
     offset = 0
-    for match in list(links_re.finditer(content)):
+    for match in list(RE_LINKS.finditer(content)):
         target = match.group(1)
         anchor = match.group(2)
         start = match.start() - offset
         offset += len(match.group())-len(anchor)
         links.append((normalise_link(target), slice(start, start+len(anchor))))
 
-    return links_re.sub(r'\2', content), links
-    return links_re.sub(r'\2', content), links
\ No newline at end of file
+    return RE_LINKS.sub(r'\2', content), links
+
+def add_stats(total, stats):
+    """Add the {name: [seconds, hits]} stats of a WikiCleaner to total."""
+    for name, (seconds, hits) in stats.items():
+        entry = total.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += hits
+
+
+def report_stats(stats):
+    """Return (name, seconds, hits) for each pattern of stats, slowest first."""
+    return sorted(((name, seconds, hits) for name, (seconds, hits) in stats.items()),
+                  key=lambda row: -row[1])
+
+
+_cleaners = {}
+
+
+def get_cleaner(language='en'):
+    """The WikiCleaner of language, created once in each process, so that the
+    patterns are compiled once per pool worker."""
+    if language not in _cleaners:
+        _cleaners[language] = WikiCleaner(language)
+    return _cleaners[language]
+
+
+def pop_stats():
+    """Return the stats of the cleaners of get_cleaner added up, and start
+    them over. Pool workers send them back with each batch this way."""
+    total = {}
+    for cleaner in _cleaners.values():
+        add_stats(total, cleaner.stats)
+        cleaner.stats = {}
+    return total
+
+
+_default_cleaner = get_cleaner('en')
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tools import each other as top-level modules, as when they're run as
+# scripts from the pywikitools directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+import io
+from ast import literal_eval
+
+import numpy as np
+import pytest
+
+from ..bow_counts import iter_mm_blocks, mm_frequencies, write_freqs
+
+gensim_corpora = pytest.importorskip('gensim.corpora')
+
+
+def write_corpus(loc, n_docs=200, n_terms=50, seed=0):
+    random = np.random.RandomState(seed)
+    docs = []
+    for _ in range(n_docs):
+        term_ids = sorted(set(random.randint(0, n_terms, size=random.randint(0, 20)).tolist()))
+        docs.append([(term_id, int(random.randint(1, 5))) for term_id in term_ids])
+    gensim_corpora.MmCorpus.serialize(loc, docs)
+    return docs
+
+
+def test_mm_frequencies(tmpdir):
+    loc = str(tmpdir.join('bow.mm'))
+    docs = write_corpus(loc)
+    n_terms = max(term_id for doc in docs for term_id, freq in doc) + 1
+    expected_tf = np.zeros(n_terms, dtype='int64')
+    expected_df = np.zeros(n_terms, dtype='int64')
+    for doc in docs:
+        for term_id, freq in doc:
+            expected_tf[term_id] += freq
+            expected_df[term_id] += 1
+    # small blocks, so lines are cut at block boundaries
+    term_freqs, doc_freqs = mm_frequencies(loc, block_bytes=100)
+    assert term_freqs.tolist() == expected_tf.tolist()
+    assert doc_freqs.tolist() == expected_df.tolist()
+
+
+def test_iter_mm_blocks_last_line_without_newline():
+    blocks = list(iter_mm_blocks(io.BytesIO(b'1 2 3\n4 5 6'), block_bytes=4))
+    assert np.concatenate(blocks).tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_write_freqs(tmpdir):
+    loc = str(tmpdir.join('freq.txt'))
+    words = ['a', "l'eau", 'caf\xe9']
+    write_freqs(loc, np.array([5, 3, 2]), np.array([2, 1, 1]), words, batch_size=2)
+    with io.open(loc, encoding='utf8') as file_:
+        rows = [line.rstrip('\n').split('\t') for line in file_]
+    assert [(int(f), int(d), literal_eval(w)) for f, d, w in rows] == \
+        [(5, 2, 'a'), (3, 1, "l'eau"), (2, 1, 'caf\xe9')]
@@ -0,0 +1,99 @@
+import bz2
+import os
+
+from .. import bz2_blocks
+from ..bz2_blocks import BZ2BlockFile, INDEX_SUFFIX, find_streams, load_index
+
+
+def write_streams(loc, n_streams=12, lines_per_stream=30):
+    """Write a bz2 file of n_streams streams, returning their offsets."""
+    offsets = []
+    pos = 0
+    with open(loc, 'wb') as file_:
+        for i in range(n_streams):
+            lines = ['stream %d line %d %s\n' % (i, j, 'x' * (j % 7))
+                     for j in range(lines_per_stream)]
+            data = bz2.compress(''.join(lines).encode('utf8'))
+            offsets.append(pos)
+            file_.write(data)
+            pos += len(data)
+    return offsets
+
+
+def read_all(loc):
+    with bz2.BZ2File(loc) as file_:
+        return file_.read()
+
+
+def test_find_streams(tmpdir):
+    loc = str(tmpdir.join('multi.bz2'))
+    offsets = write_streams(loc)
+    assert find_streams(loc) == offsets
+
+
+def test_find_streams_across_buffers(tmpdir):
+    # With these buffer sizes, some stream headers are split between two
+    # reads, and are only found in the overlap kept from the previous one.
+    loc = str(tmpdir.join('multi.bz2'))
+    offsets = write_streams(loc, n_streams=4)
+    split = [size for size in range(10, 40)
+             if any(offset % size + 10 > size for offset in offsets[1:])]
+    assert split
+    for buffer_size in range(1, 40):
+        assert find_streams(loc, buffer_size=buffer_size) == offsets
+
+
+def test_index_invalidated(tmpdir, monkeypatch):
+    loc = str(tmpdir.join('multi.bz2'))
+    offsets = write_streams(loc)
+    scans = []
+
+    def count_scans(loc):
+        scans.append(loc)
+        return find_streams(loc)
+
+    monkeypatch.setattr(bz2_blocks, 'find_streams', count_scans)
+    assert load_index(loc) == offsets
+    assert os.path.exists(loc + INDEX_SUFFIX)
+    assert load_index(loc) == offsets
+    assert len(scans) == 1
+    # another size
+    offsets = write_streams(loc, n_streams=5)
+    assert load_index(loc) == offsets
+    assert len(scans) == 2
+    # the same size, but modified since
+    stat = os.stat(loc)
+    os.utime(loc, (stat.st_atime, stat.st_mtime + 100))
+    assert load_index(loc) == offsets
+    assert len(scans) == 3
+
+
+def test_read_like_bz2file(tmpdir):
+    loc = str(tmpdir.join('multi.bz2'))
+    write_streams(loc)
+    expected = read_all(loc)
+    with BZ2BlockFile(loc, n_procs=2, chunk_bytes=200) as file_:
+        assert file_.read() == expected
+    with BZ2BlockFile(loc, n_procs=2, chunk_bytes=200) as file_:
+        pieces = []
+        while True:
+            data = file_.read(333)
+            if not data:
+                break
+            pieces.append(data)
+    assert b''.join(pieces) == expected
+
+
+def test_readline_like_bz2file(tmpdir):
+    loc = str(tmpdir.join('multi.bz2'))
+    write_streams(loc)
+    with bz2.BZ2File(loc) as file_:
+        expected = list(file_)
+    with BZ2BlockFile(loc, n_procs=3, chunk_bytes=1) as file_:
+        assert list(file_) == expected
+    with BZ2BlockFile(loc, n_procs=2, chunk_bytes=500) as file_:
+        first = file_.readline()
+        head = file_.read(10)
+        rest = list(file_)
+    assert first + head + b''.join(rest) == b''.join(expected)
+    assert first == expected[0]
@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from ..downloader import (ChecksumError, checksum_key, download_file, download_files,
+                          dump_links, fetch_checksums, make_session, parse_checksums)
+
+FILES = {
+    'xxwiki-latest-pages-articles1.xml.bz2': os.urandom(300000),
+    'xxwiki-latest-pages-articles2.xml.bz2': os.urandom(200000),
+}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve FILES, with Range requests unless the server has ranges=False.
+    With drop_after set, the first response is cut off after that many bytes."""
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        name = self.path.lstrip('/')
+        data = FILES.get(name, self.server.sums.get(name))
+        if data is None:
+            self.send_error(404)
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.server.ranges:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.drop_after is not None:
+            self.wfile.write(body[:self.server.drop_after])
+            self.server.drop_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    httpd = Server(('127.0.0.1', 0), RangeHandler)
+    httpd.ranges = True
+    httpd.drop_after = None
+    httpd.requests = []
+    httpd.sums = {}
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    httpd.url = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def md5(data):
+    return ('md5', hashlib.md5(data).hexdigest())
+
+
+def read(loc):
+    with open(loc, 'rb') as file_:
+        return file_.read()
+
+
+def test_parse_checksums():
+    text = 'abc123  xxwiki-latest-pages-articles1.xml.bz2\n\ndef456  other.txt\n'
+    assert parse_checksums(text) == {'xxwiki-latest-pages-articles1.xml.bz2': 'abc123',
+                                     'other.txt': 'def456'}
+
+
+def test_checksum_key():
+    assert (checksum_key('frwiki-20170101-pages-articles1.xml.bz2') ==
+            checksum_key('frwiki-latest-pages-articles1.xml.bz2') ==
+            'frwiki-*-pages-articles1.xml.bz2')
+    assert checksum_key('zh_yuewiki-latest-pages-articles.xml.bz2') == \
+        'zh_yuewiki-*-pages-articles.xml.bz2'
+
+
+LINKS = [
+    'frwiki-latest-pages-articles.xml.bz2',
+    'frwiki-latest-pages-articles1.xml-p1p306134.bz2',
+    'frwiki-latest-pages-articles2.xml-p306135p1050822.bz2',
+    'frwiki-latest-pages-articles-multistream.xml.bz2',
+    'frwiki-latest-pages-articles-multistream-index.txt.bz2',
+    'frwiki-latest-pages-articles-multistream1.xml-p1p306134.bz2',
+    'frwiki-latest-pages-articles-multistream-index1.txt-p1p306134.bz2',
+    'frwiki-latest-pages-articles-multistream2.xml-p306135p1050822.bz2',
+    'frwiki-latest-pages-articles-multistream-index2.txt-p306135p1050822.bz2',
+    'frwiki-latest-pages-articles1.xml-p1p306134.bz2-rss.xml',
+    'dewiki-latest-pages-articles-multistream.xml.bz2',
+]
+
+
+def test_dump_links():
+    assert dump_links(LINKS, 'fr') == LINKS[1:3]
+    assert dump_links(LINKS, 'fr', 'multistream') == LINKS[3:5]
+    assert dump_links(LINKS, 'fr', 'multistream_parts') == LINKS[5:9]
+
+
+def test_dated_checksums(server, tmpdir):
+    # the sums under /latest/ list the dated names of the -latest- files
+    names = sorted(FILES)
+    server.sums['xxwiki-latest-md5sums.txt'] = (
+        '%s  xxwiki-20170101-pages-articles1.xml.bz2\n'
+        '%s  xxwiki-20170101-pages-articles2.xml.bz2\n'
+        % (md5(FILES[names[0]])[1], md5(b'other')[1])).encode('ascii')
+    checksums = fetch_checksums(make_session(), server.url.rstrip('/'), 'xxwiki-latest')
+    assert download_files([server.url + names[0]], str(tmpdir), checksums=checksums)
+    with pytest.raises(ChecksumError):
+        download_files([server.url + names[1]], str(tmpdir), checksums=checksums)
+
+
+def test_warn_without_checksum(server, tmpdir, caplog):
+    name = sorted(FILES)[0]
+    with caplog.at_level(logging.WARNING):
+        download_files([server.url + name], str(tmpdir), checksums={})
+    assert 'no checksum' in caplog.text
+
+
+def test_download_files(server, tmpdir):
+    names = sorted(FILES)
+    checksums = dict((checksum_key(name), md5(FILES[name])) for name in names)
+    locs = download_files([server.url + name for name in names], str(tmpdir),
+                          checksums=checksums, processes=2)
+    assert [read(loc) for loc in locs] == [FILES[name] for name in names]
+    assert not [fn for fn in os.listdir(str(tmpdir)) if fn.endswith('.part')]
+
+
+def test_resume_partial_file(server, tmpdir):
+    name = 'xxwiki-latest-pages-articles1.xml.bz2'
+    with open(str(tmpdir.join(name + '.part')), 'wb') as file_:
+        file_.write(FILES[name][:1000])
+    loc = download_file(make_session(), server.url + name, str(tmpdir), checksum=md5(FILES[name]))
+    assert read(loc) == FILES[name]
+    assert server.requests == ['bytes=1000-']
+
+
+def test_resume_dropped_connection(server, tmpdir):
+    name = 'xxwiki-latest-pages-articles1.xml.bz2'
+    server.drop_after = 200000
+    loc = download_file(make_session(), server.url + name, str(tmpdir), checksum=md5(FILES[name]))
+    assert read(loc) == FILES[name]
+    # the chunk being read when the connection dropped is fetched again
+    assert len(server.requests) == 2 and server.requests[0] is None
+    assert 0 < int(server.requests[1].split('=')[1].rstrip('-')) <= 200000
+
+
+def test_restart_without_ranges(server, tmpdir):
+    name = 'xxwiki-latest-pages-articles2.xml.bz2'
+    server.ranges = False
+    with open(str(tmpdir.join(name + '.part')), 'wb') as file_:
+        file_.write(b'stale')
+    loc = download_file(make_session(), server.url + name, str(tmpdir), checksum=md5(FILES[name]))
+    assert read(loc) == FILES[name]
+
+
+def test_skip_finished_file(server, tmpdir):
+    name = 'xxwiki-latest-pages-articles2.xml.bz2'
+    with open(str(tmpdir.join(name)), 'wb') as file_:
+        file_.write(FILES[name])
+    download_file(make_session(), server.url + name, str(tmpdir), checksum=md5(FILES[name]))
+    assert server.requests == []
+
+
+def test_checksum_mismatch(server, tmpdir):
+    name = 'xxwiki-latest-pages-articles2.xml.bz2'
+    with pytest.raises(ChecksumError):
+        download_file(make_session(), server.url + name, str(tmpdir), checksum=md5(b'other'))
+    assert os.listdir(str(tmpdir)) == []
@@ -0,0 +1,55 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from ..freq_table import FreqTable, is_freq_table, write_freq_table
+
+ROWS = [(5, 2, 'Apple'), (3, 1, 'apple'), (10, 4, 'the'), (1, 1, '\xe9t\xe9'),
+        (2, 1, '日本')]
+
+
+def test_round_trip(tmpdir):
+    loc = str(tmpdir.join('freqs.table'))
+    write_freq_table(loc, sorted(ROWS, key=lambda row: row[2]))
+    assert is_freq_table(loc)
+    table = FreqTable(loc)
+    assert len(table) == len(ROWS)
+    assert list(table) == sorted(ROWS, key=lambda row: row[2])
+    assert table.total == sum(freq for freq, _, _ in ROWS)
+    for freq, doc_freq, word in ROWS:
+        i = table.index(word)
+        assert table.string(i) == word
+        assert int(table.freqs[i]) == freq
+        assert int(table.doc_freqs[i]) == doc_freq
+    assert table.index('pear') == -1
+    assert table.index('') == -1
+    assert sorted(os.listdir(str(tmpdir))) == ['freqs.table']
+
+
+def test_empty_table(tmpdir):
+    loc = str(tmpdir.join('freqs.table'))
+    write_freq_table(loc, [])
+    table = FreqTable(loc)
+    assert len(table) == 0
+    assert list(table) == []
+    assert table.index('the') == -1
+
+
+@pytest.mark.parametrize('words', [['the', 'apple'], ['apple', 'the', 'the']])
+def test_unsorted_rows(tmpdir, words):
+    loc = str(tmpdir.join('freqs.table'))
+    with pytest.raises(ValueError):
+        write_freq_table(loc, [(1, 1, word) for word in words])
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_not_a_table(tmpdir):
+    loc = str(tmpdir.join('freqs.txt'))
+    with open(loc, 'w') as file_:
+        file_.write("1\t1\t'the'\n")
+    assert not is_freq_table(loc)
+    with pytest.raises(ValueError):
+        FreqTable(loc)
@@ -0,0 +1,86 @@
+import bz2
+import os
+
+import pytest
+
+from ..multistream import MultistreamDump, index_location
+
+HEADER = b"""<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10">
+  <siteinfo><sitename>Wikipedia</sitename></siteinfo>
+"""
+PAGE = """  <page><title>%s</title><ns>0</ns><id>%d</id>
+    <revision><id>%d</id><text xml:space="preserve">Text of '''%s'''.</text></revision>
+  </page>
+"""
+
+
+def write_multistream(directory, n_pages=25, per_stream=4):
+    """Write a dump with a stream for the header, streams of per_stream
+    pages and a stream for the closing tag, like the Wikipedia ones."""
+    dump_loc = os.path.join(str(directory), 'xxwiki-latest-pages-articles-multistream.xml.bz2')
+    titles = ['Page %d: a title' % i for i in range(n_pages)]
+    index = []
+    with open(dump_loc, 'wb') as file_:
+        file_.write(bz2.compress(HEADER))
+        for start in range(0, n_pages, per_stream):
+            offset = file_.tell()
+            pages = []
+            for i in range(start, min(start + per_stream, n_pages)):
+                pageid = 10 * i + 3
+                pages.append(PAGE % (titles[i], pageid, 1000 + i, titles[i]))
+                index.append('%d:%d:%s\n' % (offset, pageid, titles[i]))
+            file_.write(bz2.compress(''.join(pages).encode('utf8')))
+        file_.write(bz2.compress(b'</mediawiki>\n'))
+    with bz2.open(index_location(dump_loc), 'wt', encoding='utf8') as file_:
+        file_.write(''.join(index))
+    return dump_loc
+
+
+def page_title(page):
+    return page[0]
+
+
+@pytest.fixture
+def dump(tmpdir):
+    return MultistreamDump(write_multistream(tmpdir))
+
+
+def test_index_location():
+    assert index_location('/d/enwiki-latest-pages-articles-multistream.xml.bz2') == \
+        '/d/enwiki-latest-pages-articles-multistream-index.txt.bz2'
+    assert index_location('enwiki-latest-pages-articles-multistream1.xml-p1p41242.bz2') == \
+        'enwiki-latest-pages-articles-multistream-index1.txt-p1p41242.bz2'
+
+
+def test_get(dump):
+    assert dump.get(title='Page 0: a title') == \
+        ('Page 0: a title', "Text of '''Page 0: a title'''.", '3')
+    # the last stream is followed by the one with the closing tag
+    assert dump.get(pageid=243)[0] == 'Page 24: a title'
+    with pytest.raises(KeyError):
+        dump.get(pageid=4)
+    with pytest.raises(KeyError):
+        dump.get(title='Missing')
+
+
+def test_ranges(dump):
+    rows = dump.rows(id_range=(50, 90))
+    assert [dump.index.titles[row] for row in rows] == ['Page %d: a title' % i for i in range(5, 9)]
+    # pages 5 to 8 are in the second and third streams, which are merged
+    ranges = dump.ranges(rows)
+    offsets = dump.index.stream_offsets.tolist()
+    assert ranges == [(offsets[1], offsets[3])]
+    assert len(dump.ranges(rows, chunk_bytes=1)) == 2
+
+
+def test_extract(dump):
+    rows = dump.rows(titles=['Page 2: a title', 'Missing'], pageids=[203])
+    pages = set(dump.extract(page_title, rows=rows, processes=2, chunk_bytes=1))
+    assert pages == set(['Page 2: a title', 'Page 20: a title'])
+    assert len(list(dump.extract(page_title, processes=2))) == 25
+
+
+def test_open(dump):
+    with dump.open(n_procs=2) as file_:
+        data = file_.read()
+    assert data.startswith(HEADER) and data.rstrip().endswith(b'</mediawiki>')
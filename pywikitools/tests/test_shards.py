@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from ..shards import ShardReader, ShardWriter, is_shard_directory
+
+
+def write_articles(directory, n_articles=50, **kwargs):
+    articles = [('Text of article %d.\nSecond line, é.' % i, 'Article %d' % i, str(i + 1))
+                for i in range(n_articles)]
+    with ShardWriter(directory, **kwargs) as writer:
+        for article in articles:
+            writer.write(article)
+    return articles
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_write_and_read(tmpdir, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    directory = str(tmpdir.join('shards'))
+    # a shard per block, and a block per 1 KB of articles
+    articles = write_articles(directory, shard_mb=0, block_kb=1, compression=compression)
+    reader = ShardReader(directory)
+    assert len(reader.shards) > 1
+    assert [(a['text'], a['title'], a['pageid']) for a in reader] == articles
+    assert reader.get(title='Article 37')['text'] == articles[37][0]
+    assert reader.get(pageid=50)['title'] == 'Article 49'
+    with pytest.raises(KeyError):
+        reader.get(title='Missing')
+
+
+def test_index_written_on_close(tmpdir):
+    directory = str(tmpdir)
+    writer = ShardWriter(directory)
+    writer.write(('text', 'title', '1'))
+    assert not is_shard_directory(directory)
+    writer.close()
+    assert is_shard_directory(directory)
+    assert sorted(os.listdir(directory)) == ['articles-00000.jsonl', 'index.tsv']
+
+
+def test_unknown_compression(tmpdir):
+    with pytest.raises(ValueError):
+        ShardWriter(str(tmpdir), compression='lz4')
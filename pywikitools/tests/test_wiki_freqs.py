@@ -0,0 +1,52 @@
+from ..sift_wiki import get_cleaner, pop_stats, report_stats
+from ..wiki_freqs import FreqCounter, count_words
+from ..wiki_pipeline import CleaningPipeline
+
+
+def split_words(args):
+    return args[0].split()
+
+
+def clean_words(args):
+    text, language, engine = args
+    return get_cleaner(language).filter_wiki(text, engine=engine).split()
+
+
+def test_count_words():
+    term_freqs, doc_freqs = count_words([['a', 'b', 'a'], ['a', 'c']])
+    assert term_freqs == {'a': 3, 'b': 1, 'c': 1}
+    assert doc_freqs == {'a': 2, 'b': 1, 'c': 1}
+
+
+def test_prune():
+    counter = FreqCounter()
+    counter.write(count_words([['a', 'b', 'a'], ['a', 'c', 'c', 'c']]))
+    counter.write(count_words([['b', 'd']]))
+    assert counter.prune(no_below=2) == [('a', 3, 2), ('b', 2, 2)]
+    assert counter.prune(no_below=1, keep_n=2) == [('a', 3, 2), ('b', 2, 2)]
+    assert counter.prune(no_below=1) == [('a', 3, 2), ('c', 3, 1), ('b', 2, 2), ('d', 1, 1)]
+
+
+def test_pipeline_combine():
+    texts = [('the cat sat', 'xx', 'regex'), ('the dog', 'xx', 'regex')] * 50
+    counter = FreqCounter()
+    pipeline = CleaningPipeline(split_words, counter.write, processes=2, target_size=20,
+                                combine=count_words)
+    pipeline.run(iter(texts))
+    assert counter.term_freqs == {'the': 100, 'cat': 50, 'sat': 50, 'dog': 50}
+    assert counter.doc_freqs == counter.term_freqs
+    assert pipeline.throughput.articles == 100
+
+
+def test_pipeline_stats():
+    texts = [("'''Bold''' and {{a}} [[b|c]]", 'en', 'regex')] * 40
+    counter = FreqCounter()
+    pipeline = CleaningPipeline(clean_words, counter.write, processes=2, target_size=100,
+                                combine=count_words, stats=pop_stats)
+    pipeline.run(iter(texts))
+    hits = dict((name, hits) for name, seconds, hits in report_stats(pipeline.stats))
+    # added up over the batches of both workers, each counted once
+    assert hits['bold'] == 40
+    assert hits['templates'] == 40
+    assert hits['links'] == 40
+    assert counter.term_freqs['Bold'] == 40
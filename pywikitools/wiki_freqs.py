@@ -0,0 +1,60 @@
+"""Count word frequencies straight from a dump, for init.py.
+
+Articles are cleaned and tokenized in the CleaningPipeline workers, and each
+worker sends back the term and document frequencies of its whole batch, so
+only one pair of counters per batch crosses the process boundary. The main
+process adds them up, and the counts are pruned once at the end: words in
+fewer than no_below articles are dropped, then only the keep_n words in the
+most articles are kept.
+"""
+from collections import Counter
+import itertools
+
+from sift_wiki import get_cleaner
+
+_tokenizers = {}
+
+
+def get_tokenizer(lang):
+    # Created once per language in each worker process.
+    if lang not in _tokenizers:
+        from spacy.util import get_lang_class
+        _tokenizers[lang] = get_lang_class(lang).Defaults.create_tokenizer()
+    return _tokenizers[lang]
+
+
+def tokenize_article(args):
+    """Return the words of an article, for (text, language, engine) args."""
+    text, language, engine = args
+    text = get_cleaner(language).filter_wiki(text, engine=engine)
+    return [token.orth_ for token in get_tokenizer(language)(text) if not token.is_space]
+
+
+def count_words(articles):
+    """Term and document frequencies of the words of a batch of articles."""
+    term_freqs = Counter(itertools.chain.from_iterable(articles))
+    doc_freqs = Counter(itertools.chain.from_iterable(set(words) for words in articles))
+    return term_freqs, doc_freqs
+
+
+class FreqCounter(object):
+    """Add up the counts of the batches, as the writer of a CleaningPipeline."""
+    def __init__(self):
+        self.term_freqs = Counter()
+        self.doc_freqs = Counter()
+
+    def write(self, counts):
+        term_freqs, doc_freqs = counts
+        self.term_freqs.update(term_freqs)
+        self.doc_freqs.update(doc_freqs)
+
+    def prune(self, no_below=20, keep_n=None):
+        """Return (word, freq, doc_freq) for the words in at least no_below
+        articles, the keep_n in the most articles if keep_n is given, most
+        frequent first."""
+        words = [word for word, doc_freq in self.doc_freqs.items() if doc_freq >= no_below]
+        if keep_n is not None and len(words) > keep_n:
+            words.sort(key=lambda word: (-self.doc_freqs[word], word))
+            words = words[:keep_n]
+        words.sort(key=lambda word: (-self.term_freqs[word], word))
+        return [(word, self.term_freqs[word], self.doc_freqs[word]) for word in words]
@@ -0,0 +1,164 @@
+"""Clean wiki articles in a process pool, with bounded memory.
+
+The XML reader feeds batches of articles to the pool, sized by the length of
+their text, and only a fixed number of batches are in flight at once. Results
+are collected as they complete, in any order, and handed to a dedicated
+writer thread. Throughput is logged in articles/s and MB/s, and at the end
+the time the workers spent in each markup pattern, if they report it.
+"""
+import functools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from sift_wiki import add_stats, report_stats
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batches(articles, target_size=1 << 20, max_articles=1000, size=None):
+    """Group articles into batches of about target_size characters of text,
+    so that a giant article goes on its own and short ones are grouped."""
+    size = size or (lambda article: len(article[0]))
+    batch = []
+    batch_size = 0
+    for article in articles:
+        batch.append(article)
+        batch_size += size(article)
+        if batch_size >= target_size or len(batch) >= max_articles:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def process_batch(process, combine, stats, batch):
+    n_bytes = sum(len(article[0].encode('utf8')) for article in batch)
+    results = [process(article) for article in batch]
+    if combine is not None:
+        results = [combine(results)]
+    return len(batch), n_bytes, results, stats() if stats is not None else {}
+
+
+class Throughput(object):
+    def __init__(self):
+        self.articles = 0
+        self.bytes = 0
+        self.start = time.time()
+
+    def add(self, n_articles, n_bytes):
+        self.articles += n_articles
+        self.bytes += n_bytes
+
+    @property
+    def elapsed(self):
+        return max(time.time() - self.start, 1e-9)
+
+    @property
+    def articles_per_sec(self):
+        return self.articles / self.elapsed
+
+    @property
+    def mb_per_sec(self):
+        return self.bytes / 1e6 / self.elapsed
+
+    def __str__(self):
+        return '{} articles, {:.1f} MB in {:.0f}s: {:.1f} articles/s, {:.2f} MB/s'.format(
+            self.articles, self.bytes / 1e6, self.elapsed,
+            self.articles_per_sec, self.mb_per_sec)
+
+
+class CleaningPipeline(object):
+    """Run process over articles in a pool of processes, and write over the
+    results in a writer thread.
+
+    process must be a picklable, module-level function. The first item of each
+    article is its text, which is used to size the batches.
+
+    If combine is given, it's called in the worker with the list of results
+    of a batch, and only what it returns is sent back and written, e.g. the
+    word counts of the batch instead of the words of each article.
+
+    If stats is given, it's called in the worker after each batch, and returns
+    the {name: [seconds, hits]} of its cleaners since the last call, such as
+    sift_wiki.pop_stats. They're added up in self.stats and logged at the end.
+    """
+    def __init__(self, process, write, processes=None, max_pending=None,
+                 target_size=1 << 20, log_interval=30, combine=None, stats=None):
+        self.process = process
+        self.combine = combine
+        self.worker_stats = stats
+        self.stats = {}
+        self.write = write
+        self.processes = processes or max(1, multiprocessing.cpu_count() - 1)
+        self.max_pending = max_pending or 2 * self.processes
+        self.target_size = target_size
+        self.log_interval = log_interval
+        self.throughput = Throughput()
+        self._stopped = False
+        self._write_error = None
+
+    def _feed(self, articles, slots):
+        # Iterated by the pool's task handler thread, which blocks here until
+        # a batch completes, so the reader never runs far ahead of the workers.
+        for batch in iter_batches(articles, target_size=self.target_size):
+            while not slots.acquire(timeout=1):
+                if self._stopped:
+                    return
+            if self._stopped:
+                return
+            yield batch
+
+    def _write_results(self, results):
+        while True:
+            batch = results.get()
+            if batch is None:
+                return
+            if self._write_error is None:
+                try:
+                    for result in batch:
+                        self.write(result)
+                except Exception as e:
+                    self._write_error = e
+
+    def run(self, articles):
+        self.throughput = Throughput()
+        self.stats = {}
+        self._stopped = False
+        slots = threading.Semaphore(self.max_pending)
+        results = queue.Queue(maxsize=self.max_pending)
+        writer = threading.Thread(target=self._write_results, args=(results,))
+        writer.start()
+        if self.worker_stats is not None:
+            # Forked workers would start with the counts of this process.
+            self.worker_stats()
+        pool = multiprocessing.Pool(self.processes)
+        last_log = time.time()
+        try:
+            tasks = self._feed(articles, slots)
+            for n_articles, n_bytes, batch, stats in pool.imap_unordered(
+                    functools.partial(process_batch, self.process, self.combine,
+                                      self.worker_stats), tasks):
+                slots.release()
+                results.put(batch)
+                self.throughput.add(n_articles, n_bytes)
+                add_stats(self.stats, stats)
+                if self._write_error is not None:
+                    raise self._write_error
+                if time.time() - last_log >= self.log_interval:
+                    logger.info(str(self.throughput))
+                    last_log = time.time()
+        finally:
+            self._stopped = True
+            pool.terminate()
+            results.put(None)
+            writer.join()
+        if self._write_error is not None:
+            raise self._write_error
+        logger.info(str(self.throughput))
+        for name, seconds, hits in report_stats(self.stats):
+            logger.info('  {:<18} {:8.2f}s {:10d} hits'.format(name, seconds, hits))
+        return self.throughput
@@ -1,11 +1,19 @@
-from displacy.server import APP, get_model
-
-# Pre-load English and German models
-get_model('en')
-get_model('de')
+from displacy.server import APP, MODELS, WARM_MODELS
 
 
 if __name__ == '__main__':
     from wsgiref import simple_server
-    httpd = simple_server.make_server('localhost', 8000, APP)
+    try:
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from SocketServer import ThreadingMixIn
+
+    # A thread per request, so that concurrent /ent requests can share batches.
+    class ThreadingWSGIServer(ThreadingMixIn, simple_server.WSGIServer):
+        daemon_threads = True
+
+    # Load the models in the background, so that the server answers at once.
+    # Under gunicorn, gunicorn.conf.py loads them before forking the workers.
+    MODELS.warm_up(WARM_MODELS)
+    httpd = simple_server.make_server('localhost', 8000, APP, server_class=ThreadingWSGIServer)
     httpd.serve_forever()
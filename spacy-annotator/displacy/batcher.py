@@ -0,0 +1,131 @@
+"""Coalesce the /ent requests of concurrent clients into shared nlp.pipe batches.
+
+Requests put their paragraphs on a queue and wait. A single worker thread
+takes the first waiting request, then keeps collecting until max_latency has
+passed since it arrived or max_batch paragraphs are waiting, runs the
+paragraphs of each model through one nlp.pipe batch, and hands every request
+its own slice of the results.
+"""
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .metrics import METRICS
+from .parse import Entities
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class _Pending(object):
+    def __init__(self, model_name, model, texts):
+        self.model_name = model_name
+        self.model = model
+        self.texts = texts
+        self.arrived = time.time()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MicroBatcher(object):
+    """Annotate the texts of concurrent requests together.
+
+    max_latency is the longest a request waits for others to join its batch,
+    in seconds, and max_batch the number of paragraphs that starts a batch
+    without waiting. lock, if given, is held while a model is running, so
+    that training can't change it in the middle of a batch.
+    """
+    def __init__(self, max_latency=0.005, max_batch=64, n_threads=2, lock=None,
+                 metrics=METRICS):
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self.n_threads = n_threads
+        self.lock = lock or threading.RLock()
+        self.queue_depth = metrics.gauge('batcher_queue_paragraphs')
+        self.batch_sizes = metrics.histogram('batcher_batch_paragraphs', BATCH_BUCKETS)
+        self.wait_times = metrics.histogram('batcher_wait_seconds')
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        # Threads don't survive a fork, so a forked worker process starts its own.
+        with self._start_lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, args=(self._queue,))
+                self._worker.daemon = True
+                self._worker.start()
+                self._pid = os.getpid()
+
+    def annotate(self, model_name, model, texts):
+        """Return the Entities of texts, once the batch they're part of has run."""
+        texts = list(texts)
+        if not texts:
+            return []
+        self._ensure_worker()
+        pending = _Pending(model_name, model, texts)
+        self.queue_depth.add(len(texts))
+        self._queue.put(pending)
+        return pending.wait()
+
+    def _collect(self, requests):
+        batch = [requests.get()]
+        size = len(batch[0].texts)
+        deadline = batch[0].arrived + self.max_latency
+        while size < self.max_batch:
+            timeout = deadline - time.time()
+            try:
+                pending = requests.get(timeout=timeout) if timeout > 0 else requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.texts)
+        return batch
+
+    def _run(self, requests):
+        while True:
+            batch = self._collect(requests)
+            start = time.time()
+            by_model = OrderedDict()
+            for pending in batch:
+                by_model.setdefault(pending.model_name, []).append(pending)
+                self.queue_depth.add(-len(pending.texts))
+                self.wait_times.observe(start - pending.arrived)
+            for group in by_model.values():
+                self._annotate_group(group)
+
+    def _annotate_group(self, group):
+        model = group[0].model
+        texts = [text for pending in group for text in pending.texts]
+        self.batch_sizes.observe(len(texts))
+        try:
+            with self.lock:
+                entities = list(Entities.pipe(model, texts, batch_size=len(texts),
+                                              n_threads=self.n_threads))
+        except Exception as e:
+            for pending in group:
+                pending.error = e
+                pending.done.set()
+            return
+        start = 0
+        for pending in group:
+            end = start + len(pending.texts)
+            pending.result = entities[start:end]
+            pending.done.set()
+            start = end
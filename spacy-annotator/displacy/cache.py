@@ -0,0 +1,165 @@
+"""Cache the /ent annotations of paragraphs that were seen before.
+
+Entries are keyed by model name, model version and the sha1 of the text, and
+hold the JSON of the paragraph's annotation. The memory tier is an LRU bounded
+by the bytes of its keys and values. An optional sqlite file keeps entries
+that were evicted, or written by another process, and is checked on a memory
+miss.
+
+Training changes a model in place, so /train invalidates its entries: they
+are dropped from memory, and the model's entries are keyed by a new version
+from then on. The version of a trained model ends with a random token drawn
+at each training, so that no other process sharing the sqlite file, nor this
+one after a restart, keys its entries the same way. When a model is dropped from memory and loaded again, it's untrained, and its
+entries are keyed by its own version again.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+
+from .metrics import METRICS
+
+
+def model_version(model):
+    meta = getattr(model, 'meta', None) or {}
+    return meta.get('version', '')
+
+
+def text_digest(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class SqliteTier(object):
+    """Entries in a sqlite file, shared by the processes using it."""
+    def __init__(self, loc):
+        self.loc = loc
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # A connection can't be used across a fork, so each process opens its own.
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.loc, check_same_thread=False, timeout=30)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS entries (model TEXT, version TEXT, '
+                               'digest TEXT, value TEXT, PRIMARY KEY (model, version, digest))')
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT value FROM entries WHERE model = ? AND version = ? AND digest = ?',
+                key).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key, value):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', key + (value,))
+            conn.commit()
+
+
+class ResultCache(object):
+    """LRU cache of paragraph annotations, of at most max_bytes in memory,
+    backed by the sqlite file at db_loc if it's given."""
+    def __init__(self, max_bytes=64 << 20, db_loc=None, metrics=METRICS):
+        self.max_bytes = max_bytes
+        self.disk = SqliteTier(db_loc) if db_loc else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self.n_bytes = 0
+        self.hits = metrics.counter('cache_hits')
+        self.disk_hits = metrics.counter('cache_disk_hits')
+        self.misses = metrics.counter('cache_misses')
+        self.evictions = metrics.counter('cache_evictions')
+        self.size = metrics.gauge('cache_bytes')
+
+    @staticmethod
+    def _entry_size(key, value):
+        return sum(len(part) for part in key) + len(value)
+
+    def version(self, model_name, model):
+        """The version the entries of model are keyed by: its own until it's
+        trained in this process."""
+        with self._lock:
+            token = self._tokens.get(model_name)
+        version = model_version(model)
+        if token is not None:
+            version = '%s+trained.%s' % (version, token)
+        return version
+
+    def get(self, model_name, version, text):
+        """Return the cached annotation of text, or None."""
+        key = (model_name, version, text_digest(text))
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits.inc()
+                self._store(key, value)
+        if value is None:
+            self.misses.inc()
+            return None
+        self.hits.inc()
+        return json.loads(value)
+
+    def put(self, model_name, version, text, result):
+        key = (model_name, version, text_digest(text))
+        value = json.dumps(result, sort_keys=True)
+        self._store(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _store(self, key, value):
+        size = self._entry_size(key, value)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.n_bytes -= self._entry_size(key, old)
+            self._entries[key] = value
+            self.n_bytes += size
+            evicted = 0
+            while self.n_bytes > self.max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self.n_bytes -= self._entry_size(old_key, old_value)
+                evicted += 1
+            n_bytes = self.n_bytes
+        self.evictions.inc(evicted)
+        self.size.set(n_bytes)
+
+    def invalidate(self, model_name):
+        """Drop the entries of model_name, after it was trained."""
+        self._drop(model_name, trained=True)
+
+    def reset(self, model_name):
+        """Drop the entries of model_name, after it was unloaded."""
+        self._drop(model_name, trained=False)
+
+    def _drop(self, model_name, trained):
+        with self._lock:
+            if trained:
+                # never reused, so a later training can't hit entries of this one
+                self._tokens[model_name] = uuid.uuid4().hex
+            else:
+                self._tokens.pop(model_name, None)
+            for key in [key for key in self._entries if key[0] == model_name]:
+                self.n_bytes -= self._entry_size(key, self._entries.pop(key))
+            n_bytes = self.n_bytes
+        self.size.set(n_bytes)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,171 @@
+"""Request metrics for the annotator server, served as JSON by /metrics.
+
+Latencies are recorded in histograms with fixed buckets, as in Prometheus,
+so that recording is cheap and the percentiles under load can be read off
+the bucket counts without keeping every sample.
+"""
+from __future__ import unicode_literals
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the buckets, in seconds. The last bucket has no upper bound.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+    """Count observed values in buckets, thread-safely."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, or None if there
+        are no observations or it's in the last bucket."""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_json(self):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        cumulative = []
+        seen = 0
+        for n in counts:
+            seen += n
+            cumulative.append(seen)
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip(bounds, cumulative)),
+        }
+
+
+class Counter(object):
+    """A count that only goes up, such as cache hits."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def to_json(self):
+        return self.value
+
+
+class Gauge(object):
+    """A value that goes up and down, such as the depth of a queue, with the
+    highest value it has reached."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+        self.max = 0
+
+    def reset(self):
+        # The value is still current, only the peak starts over.
+        with self._lock:
+            self.max = self.value
+
+    def add(self, n):
+        with self._lock:
+            self.value += n
+            self.max = max(self.max, self.value)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+            self.max = max(self.max, value)
+
+    def to_json(self):
+        with self._lock:
+            return {'value': self.value, 'max': self.max}
+
+
+class Metrics(object):
+    """Named metrics, created on first use."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.gauges = {}
+        self.counters = {}
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            return self.histograms[name]
+
+    def gauge(self, name):
+        with self._lock:
+            if name not in self.gauges:
+                self.gauges[name] = Gauge()
+            return self.gauges[name]
+
+    def counter(self, name):
+        with self._lock:
+            if name not in self.counters:
+                self.counters[name] = Counter()
+            return self.counters[name]
+
+    def reset(self):
+        for metric in (list(self.histograms.values()) + list(self.gauges.values()) +
+                       list(self.counters.values())):
+            metric.reset()
+
+    def to_json(self):
+        return {
+            'counters': dict((name, counter.to_json())
+                             for name, counter in sorted(self.counters.items())),
+            'gauges': dict((name, gauge.to_json()) for name, gauge in sorted(self.gauges.items())),
+            'histograms': dict((name, histogram.to_json())
+                               for name, histogram in sorted(self.histograms.items())),
+        }
+
+
+METRICS = Metrics()
@@ -4,9 +4,18 @@ from spacy.gold import GoldParse
 
 
 class Entities(object):
-    def __init__(self, nlp, text):
+    def __init__(self, nlp, text, doc=None):
         self.text = text
-        self.doc = nlp(text)
+        self.doc = doc if doc is not None else nlp(text)
+
+    @classmethod
+    def pipe(cls, nlp, texts, batch_size=64, n_threads=2):
+        """Annotate texts with nlp.pipe, in batches of batch_size documents.
+        The entities don't depend on the parse, so the parser isn't run."""
+        texts = list(texts)
+        docs = nlp.pipe(texts, parse=False, batch_size=batch_size, n_threads=n_threads)
+        for text, doc in zip(texts, docs):
+            yield cls(nlp, text, doc=doc)
 
     def to_json(self):
         return {
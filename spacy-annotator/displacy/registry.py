@@ -0,0 +1,157 @@
+"""Load models on first use, and keep at most max_models of them in memory.
+
+The least recently used model is dropped when another one has to be loaded.
+Each model is loaded once even if several requests ask for it at the same
+time, and loading one model doesn't hold up requests for the others. The
+registry records how long each load took and how much the resident memory of
+the process grew meanwhile, an estimate of the model's size.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+
+def resident_bytes():
+    """The resident memory of this process, or None where /proc isn't there."""
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm') as file_:
+            return int(file_.read().split()[1]) * PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+class ModelRegistry(object):
+    """Models by name, loaded with load(name) when they're first asked for.
+    max_models of None keeps every model."""
+    def __init__(self, load, max_models=None, metrics=METRICS):
+        self.load = load
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._evict_callbacks = []
+        # set once warm_up has gone through its names
+        self.warmed = threading.Event()
+        self.stats = {}
+        self.loads = metrics.counter('model_loads')
+        self.evictions = metrics.counter('model_evictions')
+        self.resident = metrics.gauge('models_resident')
+
+    def on_evict(self, callback):
+        """Call callback(name) when a model is dropped."""
+        self._evict_callbacks.append(callback)
+
+    def _lookup(self, name):
+        # with self._lock held
+        model = self._models.pop(name, None)
+        if model is not None:
+            self._models[name] = model
+            self.stats[name]['uses'] += 1
+        return model
+
+    def get(self, name):
+        with self._lock:
+            model = self._lookup(name)
+            if model is not None:
+                return model
+            load_lock = self._loading.setdefault(name, threading.Lock())
+        with load_lock:
+            try:
+                with self._lock:
+                    model = self._lookup(name)
+                if model is None:
+                    model = self._load(name)
+            finally:
+                # Drop the lock once the load is over, failed or not, so that
+                # names that can't be loaded don't pile up. Requests already
+                # waiting on it find the model, or try loading it again.
+                with self._lock:
+                    if self._loading.get(name) is load_lock:
+                        del self._loading[name]
+        return model
+
+    def _load(self, name):
+        start = time.time()
+        rss_before = resident_bytes()
+        model = self.load(name)
+        rss_after = resident_bytes()
+        stats = {
+            'load_seconds': time.time() - start,
+            'resident_bytes': rss_after - rss_before if rss_before is not None else None,
+            'uses': 1,
+        }
+        logger.info('loaded %s in %.1fs', name, stats['load_seconds'])
+        self.loads.inc()
+        with self._lock:
+            self._models[name] = model
+            self.stats[name] = stats
+            evicted = []
+            while self.max_models and len(self._models) > self.max_models:
+                evicted.append(self._models.popitem(last=False)[0])
+            self.resident.set(len(self._models))
+        for old_name in evicted:
+            self._evicted(old_name)
+        return model
+
+    def _evicted(self, name):
+        logger.info('dropped %s', name)
+        self.evictions.inc()
+        for callback in self._evict_callbacks:
+            callback(name)
+
+    def evict(self, name):
+        with self._lock:
+            model = self._models.pop(name, None)
+            self.resident.set(len(self._models))
+        if model is not None:
+            self._evicted(name)
+
+    def warm_up(self, names, background=True):
+        """Load names, in a background thread unless background is False,
+        and set self.warmed when done, whether or not they all loaded and
+        stayed loaded. Returns the thread, or None."""
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    logger.exception('could not load %s', name)
+            self.warmed.set()
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def names(self):
+        with self._lock:
+            return list(self._models)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._models
+
+    def to_json(self):
+        with self._lock:
+            resident = list(self._models)
+            stats = dict((name, dict(stats)) for name, stats in self.stats.items())
+        for name, model_stats in stats.items():
+            model_stats['resident'] = name in resident
+        return {'max_models': self.max_models, 'resident': resident, 'models': stats}
@@ -5,13 +5,20 @@ from __future__ import print_function
 import falcon
 import spacy
 import json
+import os
 import sys
+import threading
+from collections import OrderedDict
 
 from spacy.pipeline import EntityRecognizer
 
 import spacy.util
 from spacy.tagger import Tagger
 
+from .batcher import MicroBatcher
+from .cache import ResultCache
+from .metrics import METRICS
+from .registry import ModelRegistry
 from .parse import Entities, TrainEntities
 from falcon_cors import CORS
 
@@ -21,21 +28,52 @@ except NameError:
     unicode = str
 
 
-_models = {}
+# Paragraphs of an /ent request are annotated with nlp.pipe in batches of
+# this many documents. 0 annotates them one at a time.
+BATCH_SIZE = int(os.environ.get('DISPLACY_BATCH_SIZE', 64))
+N_THREADS = int(os.environ.get('DISPLACY_N_THREADS', 2))
+PARAGRAPH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# The paragraphs of concurrent /ent requests are coalesced into one batch per
+# model, waiting at most DISPLACY_MAX_LATENCY_MS for DISPLACY_MAX_BATCH
+# paragraphs. DISPLACY_MICRO_BATCH=0 runs each request on its own.
+MICRO_BATCH = os.environ.get('DISPLACY_MICRO_BATCH', '1') != '0'
+MAX_LATENCY_MS = float(os.environ.get('DISPLACY_MAX_LATENCY_MS', 5))
+MAX_BATCH = int(os.environ.get('DISPLACY_MAX_BATCH', 64))
+
+# Annotations are cached in an LRU of DISPLACY_CACHE_MB megabytes, 0 for no
+# cache, and in the sqlite file DISPLACY_CACHE_DB if it's set.
+CACHE_MB = int(os.environ.get('DISPLACY_CACHE_MB', 64))
+CACHE_DB = os.environ.get('DISPLACY_CACHE_DB') or None
+
+# Models are loaded when they're first asked for, and only the
+# DISPLACY_MAX_MODELS most recently used are kept, 0 for no limit. Dropping a
+# trained model loses its training.
+MAX_MODELS = int(os.environ.get('DISPLACY_MAX_MODELS', 3))
+# Loaded in the background when the server starts, comma separated.
+WARM_MODELS = [name for name in os.environ.get('DISPLACY_WARM_MODELS', 'en,de').split(',')
+               if name]
+
+# Held while a model runs or trains, since training changes the shared model.
+MODEL_LOCK = threading.RLock()
+
+def load_model(model_name):
+    model = spacy.load(model_name)
+    if model.tagger is None:
+        model.tagger = Tagger(model.vocab, features=Tagger.feature_templates)
+    if model.entity is None:
+        model.entity = EntityRecognizer(model.vocab, entity_types=['PERSON', 'NORP', 'FACILITY', 'ORG', 'GPE',
+                                                                   'LOC', 'PRODUCT', 'EVENT', 'WORK_OF_ART',
+                                                                   'LANGUAGE', 'DATE', 'TIME', 'PERCENT',
+                                                                   'MONEY', 'QUANTITY', 'ORDINAL', 'CARDINAL'])
+    model.pipeline = [model.tagger, model.entity, model.parser]
+    return model
+
+
+MODELS = ModelRegistry(load_model, max_models=MAX_MODELS or None)
+
 
 def get_model(model_name):
-    if model_name not in _models:
-        model = spacy.load(model_name)
-        if model.tagger is None:
-            model.tagger = Tagger(model.vocab, features=Tagger.feature_templates)
-        if model.entity is None:
-            model.entity = EntityRecognizer(model.vocab, entity_types=['PERSON', 'NORP', 'FACILITY', 'ORG', 'GPE',
-                                                                       'LOC', 'PRODUCT', 'EVENT', 'WORK_OF_ART',
-                                                                       'LANGUAGE', 'DATE', 'TIME', 'PERCENT',
-                                                                       'MONEY', 'QUANTITY', 'ORDINAL', 'CARDINAL'])
-        model.pipeline = [model.tagger, model.entity, model.parser]
-        _models[model_name] = model
-    return _models[model_name]
+    return MODELS.get(model_name)
 
 
 def update_vocabulary(model, texts):
@@ -47,26 +85,66 @@ def update_vocabulary(model, texts):
 
 class EntResource(object):
     """Parse text and return displaCy ent's expected output."""
+    def __init__(self, batch_size=BATCH_SIZE, n_threads=N_THREADS, batcher=None, cache=None):
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+        self.batcher = batcher
+        self.cache = cache
+        self.latency = METRICS.histogram('ent_latency_seconds')
+        self.sizes = METRICS.histogram('ent_paragraphs', PARAGRAPH_BUCKETS)
+
+    def annotate(self, model_name, model, texts):
+        if self.batcher is not None:
+            return self.batcher.annotate(model_name, model, texts)
+        with MODEL_LOCK:
+            if self.batch_size:
+                return list(Entities.pipe(model, texts, batch_size=self.batch_size,
+                                          n_threads=self.n_threads))
+            return [Entities(model, text) for text in texts]
+
+    def annotate_json(self, model_name, model, texts):
+        if self.cache is None:
+            return [e.to_json() for e in self.annotate(model_name, model, texts)]
+        version = self.cache.version(model_name, model)
+        results = [self.cache.get(model_name, version, text) for text in texts]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        # a paragraph repeated in the request is only annotated once
+        unique = list(OrderedDict.fromkeys(texts[i] for i in missing))
+        annotated = dict(zip(unique, (e.to_json()
+                                      for e in self.annotate(model_name, model, unique))))
+        # not cached if the model was trained in the meantime
+        if self.cache.version(model_name, model) == version:
+            for text, result in annotated.items():
+                self.cache.put(model_name, version, text, result)
+        for i in missing:
+            results[i] = annotated[texts[i]]
+        return results
+
     def on_post(self, req, resp):
-        req_body = req.stream.read()
-        json_data = json.loads(req_body.decode('utf8'))
-        paragraphs = json_data.get('paragraphs')
-        model_name = json_data.get('model', 'en')
-        try:
-            model = get_model(model_name)
-            entities = []
-            for p in paragraphs:
-                e = Entities(model, p.get('text'))
-                entities.append(e.to_json())
-            resp.body = json.dumps(entities, sort_keys=True, indent=2)
-            resp.content_type = 'application/json'
-            resp.status = falcon.HTTP_200
-        except Exception:
-            resp.status = falcon.HTTP_500
+        with self.latency.time():
+            req_body = req.stream.read()
+            json_data = json.loads(req_body.decode('utf8'))
+            paragraphs = json_data.get('paragraphs')
+            model_name = json_data.get('model', 'en')
+            try:
+                model = get_model(model_name)
+                texts = [p.get('text') for p in paragraphs]
+                self.sizes.observe(len(texts))
+                entities = self.annotate_json(model_name, model, texts)
+                resp.body = json.dumps(entities, sort_keys=True, indent=2)
+                resp.content_type = 'application/json'
+                resp.status = falcon.HTTP_200
+            except Exception:
+                resp.status = falcon.HTTP_500
 
 
 class TrainEntResource(object):
     """Parse text and use it to train the entity recognizer."""
+    def __init__(self, cache=None):
+        self.cache = cache
+
     def on_post(self, req, resp):
         req_body = req.stream.read()
         json_data = json.loads(req_body.decode('utf8'))
@@ -75,11 +153,14 @@ class TrainEntResource(object):
         try:
             model = get_model(model_name)
             texts = [paragraph.get('text') for paragraph in paragraphs]
-            update_vocabulary(model, texts)
-            entities = []
-            for p in paragraphs:
-                e = TrainEntities(model, p.get('text'), p.get('tags'))
-                entities.append(e.to_json())
+            with MODEL_LOCK:
+                update_vocabulary(model, texts)
+                entities = []
+                for p in paragraphs:
+                    e = TrainEntities(model, p.get('text'), p.get('tags'))
+                    entities.append(e.to_json())
+                if self.cache is not None:
+                    self.cache.invalidate(model_name)
             resp.body = json.dumps(entities, sort_keys=True, indent=2)
             resp.content_type = 'application/json'
             resp.status = falcon.HTTP_200
@@ -87,7 +168,43 @@ class TrainEntResource(object):
             print("Unexpected error:", sys.exc_info()[0])
             resp.status = falcon.HTTP_500
 
+
+class ModelsResource(object):
+    """Return the models of this process, with their load time and size."""
+    def on_get(self, req, resp):
+        resp.body = json.dumps(MODELS.to_json(), sort_keys=True, indent=2)
+        resp.content_type = 'application/json'
+        resp.status = falcon.HTTP_200
+
+
+class HealthResource(object):
+    """200 once the models in WARM_MODELS were loaded, 503 before. It stays
+    200 after they're dropped, since any model is loaded again on use."""
+    def on_get(self, req, resp):
+        resident = MODELS.names()
+        ready = MODELS.warmed.is_set()
+        resp.body = json.dumps({'ready': ready, 'pid': os.getpid(), 'models': resident},
+                               sort_keys=True)
+        resp.content_type = 'application/json'
+        resp.status = falcon.HTTP_200 if ready else falcon.HTTP_503
+
+
+class MetricsResource(object):
+    """Return the request metrics of this process."""
+    def on_get(self, req, resp):
+        resp.body = json.dumps(METRICS.to_json(), sort_keys=True, indent=2)
+        resp.content_type = 'application/json'
+        resp.status = falcon.HTTP_200
+
 cors = CORS(allow_all_origins=True)
 APP = falcon.API(middleware=[cors.middleware])
-APP.add_route('/ent', EntResource())
-APP.add_route('/train', TrainEntResource())
+BATCHER = MicroBatcher(max_latency=MAX_LATENCY_MS / 1000., max_batch=MAX_BATCH,
+                       n_threads=N_THREADS, lock=MODEL_LOCK) if MICRO_BATCH else None
+CACHE = ResultCache(CACHE_MB << 20, CACHE_DB) if CACHE_MB else None
+if CACHE is not None:
+    MODELS.on_evict(CACHE.reset)
+APP.add_route('/ent', EntResource(batcher=BATCHER, cache=CACHE))
+APP.add_route('/train', TrainEntResource(cache=CACHE))
+APP.add_route('/metrics', MetricsResource())
+APP.add_route('/models', ModelsResource())
+APP.add_route('/health', HealthResource())
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from ..batcher import MicroBatcher
+from ..metrics import Metrics
+
+
+class FakeDoc(object):
+    def __init__(self, text):
+        self.text = text
+        self.ents = []
+
+
+class FakeNLP(object):
+    """Record the batches that nlp.pipe is called with."""
+    def __init__(self):
+        self.batches = []
+
+    def pipe(self, texts, parse=True, batch_size=1000, n_threads=2):
+        texts = list(texts)
+        if 'boom' in texts:
+            raise ValueError('boom')
+        self.batches.append(texts)
+        return (FakeDoc(text) for text in texts)
+
+
+def annotate_concurrently(batcher, requests):
+    results = [None] * len(requests)
+
+    def client(i, model_name, model, texts):
+        try:
+            results[i] = [e.text for e in batcher.annotate(model_name, model, texts)]
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=client, args=(i,) + request)
+               for i, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_coalesce_requests():
+    nlp = FakeNLP()
+    metrics = Metrics()
+    batcher = MicroBatcher(max_latency=0.5, max_batch=6, metrics=metrics)
+    requests = [('en', nlp, ['a%d' % i, 'b%d' % i]) for i in range(3)]
+    results = annotate_concurrently(batcher, requests)
+    assert results == [texts for _, _, texts in requests]
+    assert [len(batch) for batch in nlp.batches] == [6]
+    data = metrics.to_json()
+    assert data['histograms']['batcher_batch_paragraphs']['count'] == 1
+    assert data['gauges']['batcher_queue_paragraphs'] == {'value': 0, 'max': 6}
+
+
+def test_batch_per_model():
+    en, de = FakeNLP(), FakeNLP()
+    batcher = MicroBatcher(max_latency=0.5, max_batch=4, metrics=Metrics())
+    requests = [('en', en, ['a']), ('de', de, ['b']), ('en', en, ['c']), ('de', de, ['d'])]
+    results = annotate_concurrently(batcher, requests)
+    assert results == [['a'], ['b'], ['c'], ['d']]
+    # never a batch mixing the models
+    assert sorted(text for batch in en.batches for text in batch) == ['a', 'c']
+    assert sorted(text for batch in de.batches for text in batch) == ['b', 'd']
+
+
+def test_max_latency():
+    nlp = FakeNLP()
+    batcher = MicroBatcher(max_latency=0.001, max_batch=100, metrics=Metrics())
+    assert [e.text for e in batcher.annotate('en', nlp, ['a', 'b'])] == ['a', 'b']
+    assert batcher.annotate('en', nlp, []) == []
+
+
+def test_errors_reach_the_batch():
+    nlp = FakeNLP()
+    batcher = MicroBatcher(max_latency=0.001, metrics=Metrics())
+    with pytest.raises(ValueError):
+        batcher.annotate('en', nlp, ['boom'])
+    assert [e.text for e in batcher.annotate('en', nlp, ['a'])] == ['a']
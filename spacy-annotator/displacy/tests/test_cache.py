@@ -0,0 +1,80 @@
+from ..cache import ResultCache
+from ..metrics import Metrics
+
+
+class FakeModel(object):
+    meta = {'version': '1.0.0'}
+
+
+def result(text):
+    return {'text': text, 'tags': [{'start': 0, 'end': 1, 'type': 'ORG'}]}
+
+
+def test_hit_and_miss():
+    metrics = Metrics()
+    cache = ResultCache(metrics=metrics)
+    version = cache.version('en', FakeModel())
+    assert version == '1.0.0'
+    assert cache.get('en', version, 'Google') is None
+    cache.put('en', version, 'Google', result('Google'))
+    assert cache.get('en', version, 'Google') == result('Google')
+    assert cache.get('de', version, 'Google') is None
+    assert metrics.to_json()['counters'] == {'cache_disk_hits': 0, 'cache_evictions': 0,
+                                             'cache_hits': 1, 'cache_misses': 2}
+
+
+def test_lru_eviction():
+    size = ResultCache._entry_size(('en', '1', 'x' * 40), '{"a": 1}')
+    cache = ResultCache(max_bytes=2 * size, metrics=Metrics())
+    for text in ('a', 'b'):
+        cache.put('en', '1', text, {'a': 1})
+    assert cache.get('en', '1', 'a') is not None
+    cache.put('en', '1', 'c', {'a': 1})
+    # b was the least recently used
+    assert cache.get('en', '1', 'b') is None
+    assert cache.get('en', '1', 'a') is not None
+    assert cache.get('en', '1', 'c') is not None
+    assert cache.n_bytes <= cache.max_bytes
+
+
+def test_invalidate():
+    cache = ResultCache(metrics=Metrics())
+    model = FakeModel()
+    version = cache.version('en', model)
+    cache.put('en', version, 'Google', result('Google'))
+    cache.put('de', version, 'Google', result('Google'))
+    cache.invalidate('en')
+    new_version = cache.version('en', model)
+    assert new_version != version
+    assert cache.get('en', version, 'Google') is None
+    assert cache.get('en', new_version, 'Google') is None
+    assert cache.get('de', version, 'Google') == result('Google')
+
+
+def test_sqlite_tier(tmpdir):
+    loc = str(tmpdir.join('cache.sqlite'))
+    cache = ResultCache(db_loc=loc, metrics=Metrics())
+    cache.put('en', '1', 'Google', result('Google'))
+    metrics = Metrics()
+    other = ResultCache(db_loc=loc, metrics=metrics)
+    assert other.get('en', '1', 'Google') == result('Google')
+    assert other.get('en', '1', 'Google') == result('Google')
+    assert metrics.to_json()['counters']['cache_disk_hits'] == 1
+    assert len(other) == 1
+
+
+def test_training_after_restart(tmpdir):
+    # A restarted process has the same pid and generation as before, often
+    # enough, so these mustn't be what tells trained models apart.
+    loc = str(tmpdir.join('cache.sqlite'))
+    model = FakeModel()
+    cache = ResultCache(db_loc=loc, metrics=Metrics())
+    cache.invalidate('en')
+    version = cache.version('en', model)
+    cache.put('en', version, 'Google', result('Google'))
+    restarted = ResultCache(db_loc=loc, metrics=Metrics())
+    assert restarted.version('en', model) == '1.0.0'
+    restarted.invalidate('en')
+    new_version = restarted.version('en', model)
+    assert new_version not in (version, '1.0.0')
+    assert restarted.get('en', new_version, 'Google') is None
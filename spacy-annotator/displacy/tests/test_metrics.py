@@ -0,0 +1,26 @@
+from ..metrics import Histogram, Metrics
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    data = histogram.to_json()
+    assert data['count'] == 4
+    assert data['buckets'] == {'0.1': 2, '1.0': 3, '+Inf': 4}
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) is None
+
+
+def test_empty_histogram():
+    assert Histogram().to_json()['p50'] is None
+
+
+def test_metrics():
+    metrics = Metrics()
+    assert metrics.histogram('latency') is metrics.histogram('latency')
+    metrics.histogram('latency').observe(0.2)
+    assert metrics.to_json()['histograms']['latency']['count'] == 1
+    metrics.reset()
+    assert metrics.to_json()['histograms']['latency']['count'] == 0
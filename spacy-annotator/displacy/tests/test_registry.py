@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from ..cache import ResultCache
+from ..metrics import Metrics
+from ..registry import ModelRegistry
+
+
+class FakeModel(object):
+    meta = {'version': '1.0.0'}
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Loader(object):
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.loaded = []
+
+    def __call__(self, name):
+        time.sleep(self.delay)
+        if name == 'nope':
+            raise IOError("can't find model '%s'" % name)
+        self.loaded.append(name)
+        return FakeModel(name)
+
+
+def test_lazy_load():
+    load = Loader()
+    registry = ModelRegistry(load, metrics=Metrics())
+    assert 'en' not in registry
+    assert registry.get('en').name == 'en'
+    assert registry.get('en') is registry.get('en')
+    assert load.loaded == ['en']
+    stats = registry.to_json()['models']['en']
+    assert stats['uses'] == 3 and stats['resident'] and stats['load_seconds'] >= 0
+
+
+def test_lru_eviction():
+    load = Loader()
+    evicted = []
+    registry = ModelRegistry(load, max_models=2, metrics=Metrics())
+    registry.on_evict(evicted.append)
+    registry.get('en')
+    registry.get('de')
+    registry.get('en')
+    registry.get('es')
+    assert registry.names() == ['en', 'es']
+    assert evicted == ['de']
+    registry.get('de')
+    assert load.loaded == ['en', 'de', 'es', 'de']
+    assert registry.to_json()['models']['en']['resident'] is False
+
+
+def test_no_load_locks_left():
+    registry = ModelRegistry(Loader(), metrics=Metrics())
+    registry.get('en')
+    for _ in range(3):
+        with pytest.raises(IOError):
+            registry.get('nope')
+    assert registry._loading == {}
+    assert registry.names() == ['en']
+
+
+def test_load_once_when_concurrent():
+    load = Loader(delay=0.05)
+    registry = ModelRegistry(load, metrics=Metrics())
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get('en')))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert load.loaded == ['en']
+    assert len(set(id(model) for model in models)) == 1
+    assert registry._loading == {}
+
+
+def test_warm_up():
+    load = Loader()
+    registry = ModelRegistry(load, metrics=Metrics())
+    registry.warm_up(['en', 'de']).join()
+    assert registry.names() == ['en', 'de']
+    registry.warm_up(['es'], background=False)
+    assert 'es' in registry
+
+
+def test_warmed_after_eviction():
+    # fewer slots than models to warm up: the first is dropped, but the
+    # registry is still warmed
+    registry = ModelRegistry(Loader(), max_models=1, metrics=Metrics())
+    assert not registry.warmed.is_set()
+    registry.warm_up(['en', 'de'], background=False)
+    assert registry.names() == ['de']
+    assert registry.warmed.is_set()
+
+
+def test_evicted_model_is_untrained():
+    cache = ResultCache(metrics=Metrics())
+    registry = ModelRegistry(Loader(), max_models=1, metrics=Metrics())
+    registry.on_evict(cache.reset)
+    model = registry.get('en')
+    cache.invalidate('en')
+    assert cache.version('en', model) != '1.0.0'
+    registry.get('de')
+    assert cache.version('en', registry.get('en')) == '1.0.0'
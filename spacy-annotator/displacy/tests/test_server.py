@@ -2,7 +2,7 @@ import pytest
 import falcon.testing
 import json
 
-from ..server import APP
+from ..server import APP, MODELS, WARM_MODELS
 
 
 class TestAPI(falcon.testing.TestCase):
@@ -38,3 +38,31 @@ def test_train_and_query_ents():
                 body='''{"text": "Google es una empresa.", "model": "es"}''')
     ents = json.loads(result.text)
     assert ents == [{"start": 0, "end": len("Google"), "type": "ORG"}]
+
+
+def test_ents_paragraphs():
+    test_api = TestAPI()
+    texts = ["Google is a company.", "I like London.", "Google is a company."]
+    result = test_api.simulate_post(path='/ent',
+                body=json.dumps({"model": "en", "paragraphs": [{"text": t} for t in texts]}))
+    paragraphs = json.loads(result.text)
+    assert [p['text'] for p in paragraphs] == texts
+    assert paragraphs[0] == paragraphs[2]
+    assert paragraphs[0]['tags'] == [{"start": 0, "end": len("Google"), "type": "ORG"}]
+
+
+def test_metrics():
+    test_api = TestAPI()
+    test_api.simulate_post(path='/ent',
+                body='''{"model": "en", "paragraphs": [{"text": "Google is a company."}]}''')
+    result = test_api.simulate_get(path='/metrics')
+    histograms = json.loads(result.text)['histograms']
+    assert histograms['ent_latency_seconds']['count'] >= 1
+
+
+def test_health():
+    test_api = TestAPI()
+    MODELS.warm_up(WARM_MODELS, background=False)
+    result = test_api.simulate_get(path='/health')
+    assert result.status_code == 200
+    assert json.loads(result.text)['ready']
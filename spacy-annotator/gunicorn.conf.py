@@ -0,0 +1,45 @@
+"""gunicorn settings for serving the annotator with several worker processes.
+
+    gunicorn -c gunicorn.conf.py app:APP
+
+The app and the models in DISPLACY_WARM_MODELS are loaded once, in the master,
+before the workers are forked, so the workers share the model memory
+copy-on-write instead of each loading its own copy. gc.freeze() moves the
+loaded objects out of the garbage collector's reach, so that collections in
+the workers don't write to, and copy, the shared pages.
+
+kill -HUP <master pid> replaces the workers gracefully: new workers are
+forked from the master, with the models as they were loaded, while the old
+ones finish their requests. This drops whatever /train did to the models in
+the workers. With preload_app, HUP doesn't reload the code: to deploy new
+code or models, start a new master with kill -USR2, and stop the old one
+with kill -WINCH and kill -QUIT once the new workers answer /health.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('DISPLACY_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('DISPLACY_WORKERS', multiprocessing.cpu_count()))
+# Threads, so that the micro-batcher of a worker sees concurrent requests.
+worker_class = 'gthread'
+threads = int(os.environ.get('DISPLACY_THREADS', 4))
+preload_app = True
+# Loading a model can take a while, annotating a long request too.
+timeout = int(os.environ.get('DISPLACY_TIMEOUT', 120))
+graceful_timeout = 30
+# Restart workers now and then, to give back memory that's no longer shared.
+max_requests = int(os.environ.get('DISPLACY_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded, before the workers are
+    # forked. No thread may be left running here: locks it holds would stay
+    # locked in the workers.
+    from displacy.server import MODELS, WARM_MODELS
+    MODELS.warm_up(WARM_MODELS, background=False)
+    server.log.info('loaded %s', ', '.join(MODELS.names()))
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
@@ -0,0 +1,178 @@
+"""Post /ent requests to a running server from concurrent clients, and report
+requests/s and the latency percentiles seen by the clients, along with the
+server's own /metrics.
+
+    python loadtest.py --url http://localhost:8000 --requests 200 --concurrency 8 --paragraphs 50
+
+With --workers, start the server under gunicorn with each number of workers
+in turn, on --url, and compare them. The result cache is turned off in these
+servers, since the test sends the same few paragraphs over and over.
+
+    python loadtest.py --workers 1,4,8 --requests 400 --concurrency 16
+"""
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+TEXTS = [
+    "When Sebastian Thrun started working on self-driving cars at Google in 2007, "
+    "few people outside of the company took him seriously.",
+    "Apple is looking at buying U.K. startup for $1 billion.",
+    "Banco Bilbao Vizcaya Argentaria (BBVA) es una entidad bancaria espanola, "
+    "presidida por Francisco Gonzalez Rodriguez.",
+    "Angela Merkel met Emmanuel Macron in Berlin on Tuesday to discuss the budget.",
+]
+
+
+def make_body(model, n_paragraphs, offset=0):
+    paragraphs = [{'text': TEXTS[(offset + i) % len(TEXTS)]} for i in range(n_paragraphs)]
+    return json.dumps({'model': model, 'paragraphs': paragraphs}).encode('utf8')
+
+
+def post(url, body):
+    request = Request(url, data=body, headers={'Content-Type': 'application/json'})
+    response = urlopen(request)
+    response.read()
+    return response.getcode()
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(url, model='en', n_requests=100, concurrency=4, n_paragraphs=10):
+    """Post n_requests from concurrency threads. Returns the number of
+    requests per second, the latencies and the number of errors."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(n_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            body = make_body(model, n_paragraphs, offset=i)
+            start = time.time()
+            try:
+                status = post(url + '/ent', body)
+            except Exception:
+                status = None
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return n_requests / elapsed, latencies, errors[0]
+
+
+def wait_until_ready(url, process, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('the server exited with %d' % process.returncode)
+        try:
+            if urlopen(url + '/health').getcode() == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('the server was not ready after %ds' % timeout)
+
+
+def start_server(url, n_workers, env=None):
+    """Start gunicorn with n_workers on the host and port of url."""
+    env = dict(os.environ, **(env or {}))
+    env['DISPLACY_BIND'] = url.split('://', 1)[-1]
+    env['DISPLACY_WORKERS'] = str(n_workers)
+    env.setdefault('DISPLACY_CACHE_MB', '0')
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:APP'],
+                            cwd=here, env=env)
+
+
+def compare_workers(url, worker_counts, model, n_requests, concurrency, n_paragraphs):
+    rows = []
+    for n_workers in worker_counts:
+        process = start_server(url, n_workers)
+        try:
+            wait_until_ready(url, process)
+            # one request per worker first, so that each has started up
+            run(url, model, n_workers, n_workers, 1)
+            rate, latencies, errors = run(url, model, n_requests, concurrency, n_paragraphs)
+        finally:
+            process.terminate()
+            process.wait()
+        rows.append((n_workers, rate, percentile(latencies, 0.5), percentile(latencies, 0.99),
+                     errors))
+    print('workers  requests/s  p50      p99      errors')
+    for row in rows:
+        print('%7d  %10.1f  %.3fs   %.3fs   %d' % row)
+    return rows
+
+
+def fetch_metrics(url):
+    try:
+        return json.loads(urlopen(url + '/metrics').read().decode('utf8'))
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--model', default='en')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--paragraphs', type=int, default=10,
+                        help='paragraphs per request')
+    parser.add_argument('--workers', default=None,
+                        help='comma separated numbers of gunicorn workers to compare')
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+    if args.workers:
+        compare_workers(url, [int(n) for n in args.workers.split(',')], args.model,
+                        args.requests, args.concurrency, args.paragraphs)
+        return
+    # one request first, so that the model is loaded before timing
+    post(url + '/ent', make_body(args.model, 1))
+    rate, latencies, errors = run(url, args.model, args.requests, args.concurrency,
+                                  args.paragraphs)
+    print('%d requests, %d clients, %d paragraphs each: %.1f requests/s, %d errors'
+          % (args.requests, args.concurrency, args.paragraphs, rate, errors))
+    print('latency p50 %.3fs  p90 %.3fs  p99 %.3fs  max %.3fs'
+          % (percentile(latencies, 0.5), percentile(latencies, 0.9),
+             percentile(latencies, 0.99), max(latencies)))
+    metrics = fetch_metrics(url)
+    if metrics is not None:
+        print(json.dumps(metrics['histograms'].get('ent_latency_seconds'), indent=2,
+                         sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""Make the modules the training scripts share with pywikitools importable.
+
+They live in ../pywikitools. Import this before them:
+
+    import _shared
+    from bz2_blocks import open_bz2
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                                'pywikitools'))
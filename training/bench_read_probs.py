@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Compare init.py's single-pass _read_probs_from_freqs with the previous
+two-pass implementation, on a synthetic Zipfian frequency file."""
+from __future__ import unicode_literals, print_function
+
+from ast import literal_eval
+import gzip
+import io
+import math
+import random
+import time
+
+import plac
+from pathlib import Path
+from preshed.counter import PreshCounter
+
+from init import _open_freqs, _read_probs_from_freqs
+
+
+def write_zipfian_freqs(loc, n_words, exponent=1.1, seed=0):
+    """Write n_words rows of freq, doc_freq and repr(word), with frequencies
+    following Zipf's law, in the format init.py reads."""
+    random.seed(seed)
+    max_freq = n_words
+    with io.TextIOWrapper(gzip.open(str(loc), 'wb'), encoding='utf8') as file_:
+        for rank in range(1, n_words + 1):
+            freq = max(1, int(max_freq / rank ** exponent))
+            doc_freq = max(1, int(freq * random.uniform(0.2, 1.0)))
+            word = 'w%d_%x' % (rank, random.getrandbits(32))
+            file_.write('%d\t%d\t%s\n' % (freq, doc_freq, repr(word)))
+
+
+def read_probs_two_pass(loc, max_length=100, min_doc_freq=5, min_freq=200):
+    """The previous implementation, which reads the file twice."""
+    counts = PreshCounter()
+    total = 0
+    with _open_freqs(loc) as file_:
+        for i, line in enumerate(file_):
+            freq, doc_freq, key = line.rstrip().split('\t', 2)
+            freq = int(freq)
+            counts.inc(i+1, freq)
+            total += freq
+    counts.smooth()
+    log_total = math.log(total)
+    probs = {}
+    with _open_freqs(loc) as file_:
+        for line in file_:
+            freq, doc_freq, key = line.rstrip().split('\t', 2)
+            doc_freq = int(doc_freq)
+            freq = int(freq)
+            if doc_freq >= min_doc_freq and freq >= min_freq and len(key) < max_length:
+                word = literal_eval(key)
+                smooth_count = counts.smoother(int(freq))
+                probs[word] = math.log(smooth_count) - log_total
+    oov_prob = math.log(counts.smoother(0)) - log_total
+    return probs, oov_prob
+
+
+def best_time(func, loc, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = func(loc)
+        times.append(time.time() - start)
+    return min(times), result
+
+
+@plac.annotations(
+    loc=("Location of the synthetic frequency file", "positional", None, str),
+    n_words=("Number of words to generate", "option", "n", int),
+    repeat=("Number of timed runs per implementation", "option", "r", int),
+)
+def main(loc='zipf_freqs.txt.gz', n_words=1000000, repeat=3):
+    loc = Path(loc)
+    if not loc.exists():
+        print("Writing %d words to %s" % (n_words, loc))
+        write_zipfian_freqs(loc, n_words)
+    two_pass, (old_probs, old_oov) = best_time(read_probs_two_pass, loc, repeat)
+    one_pass, (new_probs, new_oov) = best_time(_read_probs_from_freqs, loc, repeat)
+    assert set(old_probs) == set(new_probs) and old_oov == new_oov
+    assert all(abs(old_probs[word] - new_probs[word]) < 1e-9 for word in old_probs)
+    print("%d words kept" % len(new_probs))
+    print("two-pass:    %.2fs" % two_pass)
+    print("single-pass: %.2fs (%.2fx)" % (one_pass, two_pass / one_pass))
+
+
+if __name__ == '__main__':
+    plac.call(main)
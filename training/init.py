@@ -2,17 +2,21 @@
 from __future__ import unicode_literals
 
 from ast import literal_eval
+from array import array
 import math
 import gzip
 import json
 
 import plac
+import numpy
 from pathlib import Path
 
 from shutil import copyfile
 from shutil import copytree
 from collections import defaultdict
+from contextlib import contextmanager
 import io
+import time
 
 from spacy.vocab import Vocab
 from spacy.vocab import write_binary_vectors
@@ -22,6 +26,9 @@ from preshed.counter import PreshCounter
 from spacy.parts_of_speech import NOUN, VERB, ADJ
 from spacy.util import get_lang_class
 
+import _shared  # freq_table, from pywikitools
+from freq_table import FreqTable, is_freq_table
+
 
 try:
     unicode
@@ -29,88 +36,201 @@ except NameError:
     unicode = str
 
 
+def _parse_clusters(bitstrings):
+    """Parse cluster bit strings to ints in one go. They're decoded as
+    little-endian, so that we can do & 15 to get the first 4 bits. See
+    _parse_features.pyx"""
+    if not bitstrings:
+        return numpy.zeros((0,), dtype='uint64')
+    # Fixed-width byte strings, padded with null bytes, which count as 0.
+    chars = numpy.array(bitstrings, dtype='S')
+    width = chars.dtype.itemsize
+    bits = chars.view(numpy.uint8).reshape(-1, width) == ord('1')
+    weights = numpy.left_shift(numpy.uint64(1), numpy.arange(width, dtype='uint64'))
+    return (bits * weights).sum(axis=1, dtype='uint64')
+
+
+def _case_variants(word):
+    return (word.lower(), word.title(), word.upper())
+
+
+class ClusterTable(object):
+    """Brown clusters, parsed to ints and stored in an array, with a dict
+    from words to rows. Re-cased variants of the words (lower, title and
+    upper case) get the cluster of the first word in the file they're a
+    variant of. Most are resolved at lookup time, through the first word with
+    the same lower-case form. The few that can't be, because casing changes
+    the string (Straße, STRASSE), are kept in a small dict of their own."""
+    def __init__(self, words, cluster_ids):
+        self.cluster_ids = cluster_ids
+        self.words = words
+        self.index = {}
+        self.lower_index = {}
+        self.variants = {}
+        for row, word in enumerate(words):
+            first = self.index.setdefault(word, row)
+            if first != row:
+                # Repeated word: the last cluster wins, the first position stays.
+                self.cluster_ids[first] = self.cluster_ids[row]
+            self.lower_index.setdefault(word.lower(), first)
+        for word, row in self.index.items():
+            for variant in _case_variants(word):
+                if (variant not in self.index and variant not in self.variants
+                        and self._lower_row(variant) != row):
+                    lower_row = self._lower_row(variant)
+                    if lower_row is None or lower_row > row:
+                        self.variants[variant] = row
+
+    def _lower_row(self, word):
+        row = self.lower_index.get(word.lower())
+        if row is not None and word in _case_variants(self.words[row]):
+            return row
+        return None
+
+    def _row(self, word):
+        row = self.index.get(word)
+        if row is None:
+            row = self.variants.get(word)
+        if row is None:
+            row = self._lower_row(word)
+        return row
+
+    def __contains__(self, word):
+        return self._row(word) is not None
+
+    def get(self, word, default=None):
+        row = self._row(word)
+        return default if row is None else int(self.cluster_ids[row])
+
+    def __iter__(self):
+        for word in self.index:
+            yield word
+        for word, row in self.index.items():
+            seen = set()
+            for variant in _case_variants(word):
+                if (variant not in seen and variant not in self.index
+                        and self._row(variant) == row):
+                    seen.add(variant)
+                    yield variant
+
+
 def _read_clusters(loc):
     if not loc.exists():
         print("Warning: Clusters file not found")
-        return {}
-    clusters = {}
+        return ClusterTable([], _parse_clusters([]))
+    words = []
+    bitstrings = []
     for line in io.open(str(loc), 'r', encoding='utf8'):
         try:
             cluster, word, freq = line.split()
         except ValueError:
             continue
+        words.append(word)
         # If the clusterer has only seen the word a few times, its cluster is
         # unreliable.
         if int(freq) >= 3:
-            clusters[word] = cluster
+            bitstrings.append(cluster)
         else:
-            clusters[word] = '0'
-    # Expand clusters with re-casing
-    for word, cluster in list(clusters.items()):
-        if word.lower() not in clusters:
-            clusters[word.lower()] = cluster
-        if word.title() not in clusters:
-            clusters[word.title()] = cluster
-        if word.upper() not in clusters:
-            clusters[word.upper()] = cluster
-    return clusters
+            bitstrings.append('0')
+    return ClusterTable(words, _parse_clusters(bitstrings))
+
+
+def _open_freqs(loc):
+    if str(loc).endswith('gz'):
+        return io.TextIOWrapper(gzip.open(str(loc)), encoding='utf8')
+    else:
+        return io.open(str(loc), 'r', encoding='utf8')
 
 
 def _read_probs_from_freqs(loc, max_length=100, min_doc_freq=5, min_freq=200):
     if not loc.exists():
         print("Warning: Frequencies file not found")
         return {}, 0.0
+    if is_freq_table(str(loc)):
+        return _read_probs_from_table(loc, max_length=max_length,
+                                      min_doc_freq=min_doc_freq, min_freq=min_freq)
+    # Read the file once: every row goes into the counts the smoother needs,
+    # and the rows that pass the filters are kept in compact columns until
+    # the smoother is ready.
     counts = PreshCounter()
     total = 0
-    if str(loc).endswith('gz'):
-        file_ = gzip.open(str(loc))
-    else:
-        file_ = loc.open()
-    for i, line in enumerate(file_):
-        freq, doc_freq, key = line.rstrip().split('\t', 2)
-        freq = int(freq)
-        counts.inc(i+1, freq)
-        total += freq
+    words = []
+    freqs = array('q')
+    with _open_freqs(loc) as file_:
+        for i, line in enumerate(file_):
+            freq, doc_freq, key = line.rstrip().split('\t', 2)
+            freq = int(freq)
+            counts.inc(i+1, freq)
+            total += freq
+            if int(doc_freq) >= min_doc_freq and freq >= min_freq:
+                # The length of the word, not of its repr, as in the table.
+                word = literal_eval(key)
+                if len(word) < max_length:
+                    words.append(word)
+                    freqs.append(freq)
     counts.smooth()
     log_total = math.log(total)
-    if str(loc).endswith('gz'):
-        file_ = gzip.open(str(loc))
-    else:
-        file_ = loc.open()
+    log_probs = _smoothed_log_probs(counts, numpy.array(freqs, dtype='int64'), log_total)
     probs = {}
-    for line in file_:
-        freq, doc_freq, key = line.rstrip().split('\t', 2)
-        doc_freq = int(doc_freq)
-        freq = int(freq)
-        if doc_freq >= min_doc_freq and freq >= min_freq and len(key) < max_length:
-            word = literal_eval(key)
-            smooth_count = counts.smoother(int(freq))
-            probs[word] = math.log(smooth_count) - log_total
+    for word, prob in zip(words, log_probs.tolist()):
+        probs[word] = prob
     oov_prob = math.log(counts.smoother(0)) - log_total
     return probs, oov_prob
 
 
+def _smoothed_log_probs(counts, freqs, log_total):
+    # There are far fewer distinct frequencies than words, so only call the
+    # smoother once per distinct value.
+    values, inverse = numpy.unique(freqs, return_inverse=True)
+    smoothed = numpy.array([counts.smoother(int(value)) for value in values])
+    return numpy.log(smoothed)[inverse] - log_total
+
+
+def _read_probs_from_table(loc, max_length=100, min_doc_freq=5, min_freq=200):
+    table = FreqTable(str(loc))
+    counts = PreshCounter()
+    for i, freq in enumerate(table.freqs.tolist()):
+        counts.inc(i+1, freq)
+    counts.smooth()
+    log_total = math.log(table.total)
+    keep = numpy.flatnonzero((table.doc_freqs >= min_doc_freq) & (table.freqs >= min_freq))
+    log_probs = _smoothed_log_probs(counts, table.freqs[keep], log_total)
+    probs = {}
+    for i, prob in zip(keep.tolist(), log_probs.tolist()):
+        word = table.string(i)
+        if len(word) < max_length:
+            probs[word] = prob
+    oov_prob = math.log(counts.smoother(0)) - log_total
+    return probs, oov_prob
+
+
+@contextmanager
+def _timed(stage):
+    start = time.time()
+    yield
+    print("%s: %.2fs" % (stage, time.time() - start))
+
+
 def populate_vocab(vocab, clusters, probs, oov_prob):
-    # Ensure probs has entries for all words seen during clustering.
-    for word in clusters:
-        if word not in probs:
-            probs[word] = oov_prob
-    #lexicon = []
-    #for word, prob in reversed(sorted(list(probs.items()), key=lambda item: item[1])):
-    #    # First encode the strings into the StringStore. This way, we can map
-    #    # the orth IDs to frequency ranks
-    #    orth = vocab.strings[word]
-    # Now actually load the vocab
-    for word, prob in reversed(sorted(list(probs.items()), key=lambda item: item[1])):
-        lexeme = vocab[word]
-        lexeme.prob = prob
-        lexeme.is_oov = False
-        # Decode as a little-endian string, so that we can do & 15 to get
-        # the first 4 bits. See _parse_features.pyx
-        if word in clusters:
-            lexeme.cluster = int(clusters[word][::-1], 2)
-        else:
-            lexeme.cluster = 0
+    with _timed("Collect words"):
+        # Ensure probs has entries for all words seen during clustering.
+        for word in clusters:
+            if word not in probs:
+                probs[word] = oov_prob
+        words = list(probs.keys())
+        word_probs = numpy.fromiter(probs.values(), dtype='float64', count=len(words))
+    with _timed("Sort by probability"):
+        # Most probable first, so that orth IDs follow frequency ranks.
+        order = numpy.argsort(word_probs, kind='mergesort')[::-1]
+    with _timed("Look up clusters"):
+        cluster_ids = numpy.array([clusters.get(word, 0) for word in words], dtype='uint64')
+    with _timed("Write lexemes"):
+        for i, prob, cluster in zip(order.tolist(), word_probs[order].tolist(),
+                                    cluster_ids[order].tolist()):
+            lexeme = vocab[words[i]]
+            lexeme.prob = prob
+            lexeme.is_oov = False
+            lexeme.cluster = cluster
 
 
 def write_vectors(src_dir, dst_dir):
@@ -135,9 +255,12 @@ def main(lang_id, model_dir, freqs_loc, clusters_loc=None, vectors_loc=None):
 
     vocab = get_lang_class(lang_id).Defaults.create_vocab()
 
-    clusters = _read_clusters(clusters_loc)
-    probs, oov_prob = _read_probs_from_freqs(freqs_loc)
-    populate_vocab(vocab, clusters, probs, oov_prob)
+    with _timed("Read clusters"):
+        clusters = _read_clusters(clusters_loc)
+    with _timed("Read frequencies"):
+        probs, oov_prob = _read_probs_from_freqs(freqs_loc)
+    with _timed("Populate vocab"):
+        populate_vocab(vocab, clusters, probs, oov_prob)
 
     if not model_dir.exists():
         model_dir.mkdir()
@@ -0,0 +1,77 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import io
+import random
+
+from pathlib import Path
+
+from init import ClusterTable, _parse_clusters, _read_probs_from_freqs
+from freq_table import write_freq_table
+
+
+def expand_clusters(words, bitstrings):
+    """The dict _read_clusters built before ClusterTable."""
+    clusters = {}
+    for word, bitstring in zip(words, bitstrings):
+        clusters[word] = bitstring
+    for word, cluster in list(clusters.items()):
+        if word.lower() not in clusters:
+            clusters[word.lower()] = cluster
+        if word.title() not in clusters:
+            clusters[word.title()] = cluster
+        if word.upper() not in clusters:
+            clusters[word.upper()] = cluster
+    return clusters
+
+
+def check_same(words):
+    bitstrings = [bin(i + 1)[2:] for i in range(len(words))]
+    expected = expand_clusters(words, bitstrings)
+    table = ClusterTable(list(words), _parse_clusters(bitstrings))
+    assert list(table) == list(expected)
+    ids = dict(zip(bitstrings, _parse_clusters(bitstrings).tolist()))
+    for word, bitstring in expected.items():
+        assert table.get(word) == ids[bitstring], word
+    for word in words:
+        for probe in (word.swapcase(), word + 'x', word.lower().title()):
+            assert (probe in table) == (probe in expected), probe
+
+
+def test_ascii_words():
+    check_same(['the', 'The', 'Google', 'NASA', 'iPhone', 'the'])
+
+
+def test_casing_changes_the_string():
+    check_same(['Straße', 'strasse', 'ﬁsh', 'İstanbul', 'istanbul', 'ǅemal', 'ß'])
+    table = ClusterTable(['Straße'], _parse_clusters(['101']))
+    assert table.get('STRASSE') == table.get('Straße')
+
+
+def test_fuzz_against_expansion():
+    alphabet = 'aAsSßẞıIİiǅǆǄﬁﬂéÉ'
+    rng = random.Random(0)
+    for _ in range(200):
+        words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+                 for _ in range(rng.randint(1, 12))]
+        check_same(words)
+
+
+def test_text_and_table_probs(tmpdir):
+    # 'étéétéété' is shorter than max_length, but its repr isn't
+    rows = [(50, 9, 'the'), (20, 5, 'apple'), (12, 4, "it's"), (9, 3, '\xe9t\xe9' * 3),
+            (8, 1, 'rare'), (7, 3, 'x' * 12), (1, 1, 'once')]
+    text_loc = str(tmpdir.join('freqs.txt'))
+    with io.open(text_loc, 'w', encoding='utf8') as file_:
+        for freq, doc_freq, word in rows:
+            file_.write('%d\t%d\t%r\n' % (freq, doc_freq, word))
+    table_loc = str(tmpdir.join('freqs.table'))
+    write_freq_table(table_loc, sorted(rows, key=lambda row: row[2]))
+    options = dict(max_length=10, min_doc_freq=2, min_freq=5)
+    text_probs, text_oov = _read_probs_from_freqs(Path(text_loc), **options)
+    table_probs, table_oov = _read_probs_from_freqs(Path(table_loc), **options)
+    assert sorted(text_probs) == sorted(['the', 'apple', "it's", '\xe9t\xe9' * 3])
+    assert text_oov == table_oov
+    assert set(text_probs) == set(table_probs)
+    for word, prob in text_probs.items():
+        assert abs(prob - table_probs[word]) < 1e-12, word
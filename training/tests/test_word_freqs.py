@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import bz2
+import collections
+import io
+import json
+import os
+
+import pytest
+
+import word_freqs
+from word_freqs import (count_freqs, iter_sorted_counts, merge_counts, merge_incremental,
+                        merge_sorted_counts, shard_is_done)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def count_lines(lines):
+    """count_batch, with str.split as the tokenizer."""
+    counts = collections.Counter()
+    for line in lines:
+        counts.update(json.loads(line)['body'].split())
+    return sum(len(line) for line in lines), len(lines), sorted(counts.items())
+
+
+def interrupt_after(n_batches, counted):
+    def count(lines):
+        if len(counted) == n_batches:
+            raise Interrupted()
+        counted.append(len(lines))
+        return count_lines(lines)
+    return count
+
+
+def write_comments(loc, n_lines):
+    with bz2.BZ2File(loc, 'w') as file_:
+        for i in range(n_lines):
+            body = 'the comment number %d of %d with %s' % (i, n_lines, 'word ' * (i % 3))
+            file_.write((json.dumps({'body': body}) + '\n').encode('utf8'))
+
+
+def read_counts(loc):
+    counts = {}
+    with io.open(loc, 'r', encoding='utf8') as file_:
+        for line in file_:
+            freq, word = line.rstrip('\n').split('\t', 1)
+            counts[word] = int(freq)
+    return counts
+
+
+def read_bytes(loc):
+    with open(loc, 'rb') as file_:
+        return file_.read()
+
+
+def partial_files(directory):
+    return [name for name in os.listdir(directory) if '.partial.' in name]
+
+
+def test_resume_interrupted_count(tmpdir, monkeypatch):
+    input_loc = str(tmpdir.join('comments.bz2'))
+    write_comments(input_loc, 20)
+    monkeypatch.setattr(word_freqs, 'count_batch', count_lines)
+    expected_loc = str(tmpdir.join('expected.freq'))
+    count_freqs(input_loc, expected_loc, batch_size=2, checkpoint_every=1)
+
+    output_loc = str(tmpdir.join('comments.freq'))
+    counted = []
+    monkeypatch.setattr(word_freqs, 'count_batch', interrupt_after(3, counted))
+    with pytest.raises(Interrupted):
+        count_freqs(input_loc, output_loc, batch_size=2, checkpoint_every=1)
+    assert not shard_is_done(input_loc, output_loc)
+    assert len(partial_files(str(tmpdir))) == 1
+
+    counted = []
+    monkeypatch.setattr(word_freqs, 'count_batch', interrupt_after(None, counted))
+    count_freqs(input_loc, output_loc, batch_size=2, checkpoint_every=1, resume=True)
+    # the 6 lines of the 3 checkpointed batches aren't counted again
+    assert sum(counted) == 14
+    assert read_bytes(output_loc) == read_bytes(expected_loc)
+    assert shard_is_done(input_loc, output_loc)
+    assert partial_files(str(tmpdir)) == []
+
+
+def test_truncated_shard_is_not_done(tmpdir, monkeypatch):
+    input_loc = str(tmpdir.join('comments.bz2'))
+    write_comments(input_loc, 10)
+    monkeypatch.setattr(word_freqs, 'count_batch', count_lines)
+    output_loc = str(tmpdir.join('comments.freq'))
+    count_freqs(input_loc, output_loc, batch_size=3)
+    assert shard_is_done(input_loc, output_loc)
+    data = read_bytes(output_loc)
+    with open(output_loc, 'wb') as file_:
+        file_.write(data[:len(data) // 2])
+    assert not shard_is_done(input_loc, output_loc)
+
+
+def write_shard(loc, counts):
+    with io.open(loc, 'w', encoding='utf8') as file_:
+        for word, freq in sorted(counts.items()):
+            file_.write('%d\t%s\n' % (freq, word))
+    return loc
+
+
+def test_merge_incremental(tmpdir, monkeypatch):
+    merged = []
+
+    def record_merge(locs, out_loc):
+        merged.append(list(locs))
+        merge_counts(locs, out_loc)
+
+    monkeypatch.setattr(word_freqs, 'merge_counts', record_merge)
+    a = write_shard(str(tmpdir.join('a.freq')), {'apple': 1, 'pear': 2})
+    b = write_shard(str(tmpdir.join('b.freq')), {'pear': 3, 'plum': 4})
+    out_loc = str(tmpdir.join('merged.freq'))
+    merge_incremental([a, b], out_loc)
+    assert merged == [[a, b]]
+    assert read_counts(out_loc) == {'apple': 1, 'pear': 5, 'plum': 4}
+
+    c = write_shard(str(tmpdir.join('c.freq')), {'apple': 10, 'fig': 1})
+    merge_incremental([a, b, c], out_loc)
+    assert merged[-1] == [out_loc, c]
+    assert read_counts(out_loc) == {'apple': 11, 'fig': 1, 'pear': 5, 'plum': 4}
+
+    merge_incremental([a, b, c], out_loc)
+    assert len(merged) == 2
+
+    write_shard(a, {'apple': 2})
+    merge_incremental([a, b, c], out_loc)
+    assert merged[-1] == [a, b, c]
+    assert read_counts(out_loc) == {'apple': 12, 'fig': 1, 'pear': 3, 'plum': 4}
+
+
+def test_merge_sorted_counts_in_rounds(tmpdir):
+    # 5 shards with max_open=2 take two rounds of spilled merges
+    words = ['a', 'ab', 'b', 'ba', 'c', 'z', '\xe9t\xe9']
+    locs = []
+    for i in range(5):
+        counts = dict((word, i + j) for j, word in enumerate(words) if (i + j) % 3)
+        locs.append(write_shard(str(tmpdir.join('%d.freq' % i)), counts))
+    sorted_loc = str(tmpdir.join('sorted.freq'))
+    merge_sorted_counts(locs, sorted_loc, max_open=2, tmp_dir=str(tmpdir))
+    expected_loc = str(tmpdir.join('expected.freq'))
+    merge_counts(locs, expected_loc)
+    assert read_counts(sorted_loc) == read_counts(expected_loc)
+    # the output is sorted too, and the spilled files are gone
+    assert list(iter_sorted_counts(sorted_loc))
+    assert sorted(os.listdir(str(tmpdir))) == sorted(['%d.freq' % i for i in range(5)] +
+                                                     ['sorted.freq', 'expected.freq'])
+
+
+def test_unsorted_shard(tmpdir):
+    loc = str(tmpdir.join('unsorted.freq'))
+    with io.open(loc, 'w', encoding='utf8') as file_:
+        file_.write('1\tpear\n2\tapple\n')
+    with pytest.raises(ValueError):
+        merge_sorted_counts([loc], str(tmpdir.join('merged.freq')))
@@ -0,0 +1,20 @@
+import os
+import time
+
+from word_vectors import corpus_stamp, has_stamp, write_stamp
+
+
+def test_cache_stamp(tmpdir):
+    in_dir = tmpdir.mkdir('in')
+    in_dir.join('a.txt').write('hello world\n')
+    cache_loc = str(tmpdir.join('vectors.tokens'))
+    assert not has_stamp(cache_loc, corpus_stamp(str(in_dir), 'en'))
+    write_stamp(cache_loc, corpus_stamp(str(in_dir), 'en'))
+    assert has_stamp(cache_loc, corpus_stamp(str(in_dir), 'en'))
+    assert not has_stamp(cache_loc, corpus_stamp(str(in_dir), 'de'))
+    other = tmpdir.mkdir('other')
+    other.join('a.txt').write('hello world\n')
+    assert not has_stamp(cache_loc, corpus_stamp(str(other), 'en'))
+    in_dir.join('a.txt').write('hello again\n')
+    os.utime(str(in_dir.join('a.txt')), (time.time() + 10, time.time() + 10))
+    assert not has_stamp(cache_loc, corpus_stamp(str(in_dir), 'en'))
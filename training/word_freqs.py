@@ -6,7 +6,13 @@ import plac
 import joblib
 from os import path
 import os
-import bz2
+import collections
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import shutil
+import tempfile
 import ujson
 from preshed.counter import PreshCounter
 from joblib import Parallel, delayed
@@ -18,29 +24,197 @@ from spacy.attrs import ORTH
 from spacy.tokenizer import Tokenizer
 from spacy.vocab import Vocab
 
+import _shared  # bz2_blocks and freq_table, from pywikitools
+from bz2_blocks import open_bz2
+from freq_table import write_freq_table
 
-def iter_comments(loc):
-    with bz2.BZ2File(loc) as file_:
+
+BATCH_SIZE = 10000
+
+_tokenizer = None
+
+
+def get_tokenizer():
+    # Load the tokenizer once per process, so pool workers can reuse it.
+    global _tokenizer
+    if _tokenizer is None:
+        vocab = English.default_vocab(get_lex_attr=None)
+        _tokenizer = Tokenizer.from_dir(vocab,
+                        path.join(English.default_data_dir(), 'tokenizer'))
+    return _tokenizer
+
+
+def iter_lines(loc, bz2_procs=1, start=0):
+    # Lines before the byte offset start are decompressed, but skipped.
+    with open_bz2(loc, n_procs=bz2_procs) as file_:
+        offset = 0
         for line in file_:
-            yield ujson.loads(line)
+            if offset < start:
+                offset += len(line)
+                continue
+            yield line
 
 
-def count_freqs(input_loc, output_loc):
-    print(output_loc)
-    vocab = English.default_vocab(get_lex_attr=None)
-    tokenizer = Tokenizer.from_dir(vocab,
-                    path.join(English.default_data_dir(), 'tokenizer'))
+def iter_comments(loc, bz2_procs=1):
+    for line in iter_lines(loc, bz2_procs=bz2_procs):
+        yield ujson.loads(line)
 
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def imap_bounded(pool, func, items, max_pending):
+    """Like pool.imap, but only max_pending tasks are in flight at once, so
+    the input isn't read into memory faster than the workers consume it."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def count_batch(lines):
+    # Orth IDs aren't shared between processes, so send back the strings.
+    tokenizer = get_tokenizer()
     counts = PreshCounter()
-    for json_comment in iter_comments(input_loc):
-        doc = tokenizer(json_comment['body'])
+    for line in lines:
+        doc = tokenizer(ujson.loads(line)['body'])
         doc.count_by(ORTH, counts=counts)
+    strings = tokenizer.vocab.strings
+    entries = [(strings[orth], freq) for orth, freq in counts]
+    return sum(len(line) for line in lines), len(lines), entries
+
+
+MANIFEST_SUFFIX = '.manifest'
+
+
+def file_checksum(loc):
+    md5 = hashlib.md5()
+    with open(loc, 'rb') as file_:
+        for block in iter(lambda: file_.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_manifest(loc):
+    try:
+        with open(loc + MANIFEST_SUFFIX) as file_:
+            return ujson.loads(file_.read())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_manifest(loc, **entries):
+    tmp_loc = loc + MANIFEST_SUFFIX + '.tmp'
+    with open(tmp_loc, 'w') as file_:
+        file_.write(ujson.dumps(entries))
+    os.rename(tmp_loc, loc + MANIFEST_SUFFIX)
+
+
+def input_stamp(input_loc):
+    stat = os.stat(input_loc)
+    return {'input': input_loc, 'input_size': stat.st_size,
+            'input_mtime': int(stat.st_mtime)}
+
+
+def same_input(manifest, input_loc):
+    stamp = input_stamp(input_loc)
+    return all(manifest.get(key) == value for key, value in stamp.items())
+
+
+def shard_is_done(input_loc, output_loc):
+    manifest = read_manifest(output_loc)
+    return (manifest is not None and manifest.get('status') == 'done'
+            and same_input(manifest, input_loc) and path.exists(output_loc)
+            and file_checksum(output_loc) == manifest.get('checksum'))
 
-    with io.open(output_loc, 'w', 'utf8') as file_:
-        for orth, freq in counts:
-            string = tokenizer.vocab.strings[orth]
+
+def write_counts(loc, counts, strings):
+    """Write the counts sorted by string, so that shards can be combined with
+    a streaming k-way merge (see merge_sorted_counts). The file is written
+    under a temporary name and renamed, so it's never seen half-written.
+    Returns the checksum of the file."""
+    entries = sorted((strings[orth], freq) for orth, freq in counts)
+    tmp_loc = loc + '.tmp'
+    with io.open(tmp_loc, 'w', encoding='utf8') as file_:
+        for string, freq in entries:
             if not string.isspace():
                 file_.write('%d\t%s\n' % (freq, string))
+    os.rename(tmp_loc, loc)
+    return file_checksum(loc)
+
+
+def partial_counts_loc(output_loc, lines):
+    # Each checkpoint has its own file, and the manifest is pointed at it only
+    # once it's written, so the counts and the offset can't get out of step.
+    return '%s.partial.%d' % (output_loc, lines)
+
+
+def remove_partial_counts(output_loc, keep=None):
+    directory, name = path.split(output_loc)
+    for filename in os.listdir(directory or '.'):
+        loc = path.join(directory, filename)
+        if filename.startswith(name + '.partial.') and loc != keep:
+            os.unlink(loc)
+
+
+def count_freqs(input_loc, output_loc, n_procs=1, batch_size=BATCH_SIZE, bz2_procs=1,
+                resume=False, checkpoint_every=100):
+    print(output_loc)
+    strings = StringStore()
+    counts = PreshCounter()
+    offset = 0
+    lines = 0
+    manifest = read_manifest(output_loc)
+    partial_loc = manifest.get('partial') if manifest is not None else None
+    if (resume and manifest is not None and manifest.get('status') == 'running'
+            and same_input(manifest, input_loc) and partial_loc and path.exists(partial_loc)):
+        for word, freq in iter_sorted_counts(partial_loc):
+            counts.inc(strings[word], freq)
+        offset = manifest['offset']
+        lines = manifest['lines']
+        print("Resuming %s from line %d" % (input_loc, lines))
+
+    batches = iter_batches(iter_lines(input_loc, bz2_procs=bz2_procs, start=offset),
+                           batch_size)
+    pool = None
+    if n_procs <= 1:
+        results = (count_batch(batch) for batch in batches)
+    else:
+        # Tokenize the line batches of the single input stream in a process
+        # pool, and reduce the partial counts here.
+        pool = multiprocessing.Pool(n_procs)
+        results = imap_bounded(pool, count_batch, batches, n_procs * 2)
+    try:
+        for i, (n_bytes, n_lines, entries) in enumerate(results, 1):
+            for string, freq in entries:
+                counts.inc(strings[string], freq)
+            offset += n_bytes
+            lines += n_lines
+            if i % checkpoint_every == 0:
+                partial_loc = partial_counts_loc(output_loc, lines)
+                write_counts(partial_loc, counts, strings)
+                write_manifest(output_loc, status='running', offset=offset, lines=lines,
+                               partial=partial_loc, **input_stamp(input_loc))
+                remove_partial_counts(output_loc, keep=partial_loc)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    checksum = write_counts(output_loc, counts, strings)
+    write_manifest(output_loc, status='done', offset=offset, lines=lines,
+                   checksum=checksum, **input_stamp(input_loc))
+    remove_partial_counts(output_loc)
 
 
 def parallelize(func, iterator, n_jobs):
@@ -62,14 +236,110 @@ def merge_counts(locs, out_loc):
             file_.write('%d\t%s\n' % (count, string))
 
 
+def iter_sorted_counts(loc):
+    with io.open(loc, 'r', encoding='utf8') as file_:
+        prev = None
+        for line in file_:
+            freq, word = line.rstrip('\n').split('\t', 1)
+            if prev is not None and word < prev:
+                raise ValueError("%s is not sorted by string. Recount it, or "
+                                 "merge without --sorted_merge" % loc)
+            prev = word
+            yield word, int(freq)
+
+
+def _merge_sorted_shards(locs, out_loc):
+    merged = heapq.merge(*[iter_sorted_counts(loc) for loc in locs])
+    with io.open(out_loc, 'w', encoding='utf8') as file_:
+        for word, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+            file_.write('%d\t%s\n' % (sum(freq for _, freq in entries), word))
+
+
+def merge_sorted_counts(locs, out_loc, max_open=64, tmp_dir=None):
+    """Merge shards sorted by string with an external k-way merge.
+
+    Only one line per open shard is held in memory. If there are more than
+    max_open shards, they're merged in chunks that spill to temporary files,
+    which are then merged in turn, so memory stays constant however many
+    shards there are.
+    """
+    locs = list(locs)
+    tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        round_ = 0
+        while len(locs) > max_open:
+            spilled = []
+            for i in range(0, len(locs), max_open):
+                chunk_loc = path.join(tmp_dir, '%d-%d.freq' % (round_, i))
+                _merge_sorted_shards(locs[i:i + max_open], chunk_loc)
+                spilled.append(chunk_loc)
+            for loc in locs:
+                if loc.startswith(tmp_dir):
+                    os.unlink(loc)
+            locs = spilled
+            round_ += 1
+        _merge_sorted_shards(locs, out_loc)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def merge_incremental(locs, out_loc, sorted_merge=False, max_open=64):
+    """Fold the shards into the merged counts at out_loc, merging only the
+    shards that are new since the last merge. If a shard that was already
+    merged changed or went missing, everything is merged again."""
+    checksums = dict((loc, file_checksum(loc)) for loc in locs)
+    manifest = read_manifest(out_loc)
+    merged = {}
+    if (manifest is not None and manifest.get('sorted') == sorted_merge
+            and path.exists(out_loc)
+            and file_checksum(out_loc) == manifest.get('checksum')):
+        merged = manifest['shards']
+    if any(checksums.get(loc) != checksum for loc, checksum in merged.items()):
+        merged = {}
+    new = [loc for loc in locs if loc not in merged]
+    if merged and not new:
+        print("Merged counts are up to date")
+        return
+    inputs = ([out_loc] if merged else []) + new
+    tmp_loc = out_loc + '.tmp'
+    if sorted_merge:
+        merge_sorted_counts(inputs, tmp_loc, max_open=max_open)
+    else:
+        merge_counts(inputs, tmp_loc)
+    os.rename(tmp_loc, out_loc)
+    merged.update((loc, checksums[loc]) for loc in new)
+    write_manifest(out_loc, sorted=sorted_merge, checksum=file_checksum(out_loc),
+                   shards=merged)
+
+
+def write_table(counts_loc, table_loc, is_sorted=False):
+    if is_sorted:
+        entries = iter_sorted_counts(counts_loc)
+    else:
+        with io.open(counts_loc, 'r', encoding='utf8') as file_:
+            entries = sorted((word, int(freq)) for freq, word in
+                             (line.rstrip('\n').split('\t', 1) for line in file_))
+    # We don't count document frequencies here. A word can't occur in more
+    # documents than its frequency, so that's the best bound we have.
+    write_freq_table(table_loc, ((freq, freq, word) for word, freq in entries))
+
+
 @plac.annotations(
     input_loc=("Location of input file list"),
     freqs_dir=("Directory for frequency files"),
     output_loc=("Location for output file"),
     n_jobs=("Number of workers", "option", "n", int),
-    skip_existing=("Skip inputs where an output file exists", "flag", "s", bool),
+    skip_existing=("Skip finished shards and resume interrupted ones", "flag", "s", bool),
+    sorted_merge=("Merge the sorted shards with a bounded-memory k-way merge", "flag", "m", bool),
+    max_open=("Maximum number of shards merged at once with --sorted_merge", "option", "k", int),
+    n_procs=("Number of tokenizer processes per input file", "option", "p", int),
+    bz2_procs=("Number of bz2 decompression processes per input file", "option", "z", int),
+    checkpoint_every=("Checkpoint shards every N batches of lines", "option", "c", int),
+    table_loc=("Also write the merged counts as a binary frequency table", "option", "t", str),
 )
-def main(input_loc, freqs_dir, output_loc, n_jobs=2, skip_existing=False):
+def main(input_loc, freqs_dir, output_loc, n_jobs=2, skip_existing=False,
+         sorted_merge=False, max_open=64, n_procs=1, bz2_procs=1, checkpoint_every=100,
+         table_loc=None):
     tasks = []
     outputs = []
     for input_path in open(input_loc):
@@ -79,15 +349,25 @@ def main(input_loc, freqs_dir, output_loc, n_jobs=2, skip_existing=False):
         filename = input_path.split('/')[-1]
         output_path = path.join(freqs_dir, filename.replace('bz2', 'freq'))
         outputs.append(output_path)
-        if not path.exists(output_path) or not skip_existing:
-            tasks.append((input_path, output_path))
+        if not skip_existing or not shard_is_done(input_path, output_path):
+            tasks.append((input_path, output_path, n_procs, BATCH_SIZE, bz2_procs,
+                          skip_existing, checkpoint_every))
 
     if tasks:
-        parallelize(count_freqs, tasks, n_jobs)
+        if n_procs > 1 or bz2_procs > 1:
+            # Each file gets its own process pools, and pool workers can't
+            # start pools of their own, so go through files in turn.
+            for task in tasks:
+                count_freqs(*task)
+        else:
+            parallelize(count_freqs, tasks, n_jobs)
 
     print("Merge")
-    merge_counts(outputs, output_loc)
-                
+    merge_incremental(outputs, output_loc, sorted_merge=sorted_merge, max_open=max_open)
+    if table_loc is not None:
+        print("Write table")
+        write_table(output_loc, table_loc, is_sorted=sorted_merge)
+
 
 if __name__ == '__main__':
     plac.call(main)
@@ -2,12 +2,15 @@ from __future__ import print_function, unicode_literals, division
 import io
 import bz2
 import logging
+import multiprocessing
 from os import path
 import os
 import random
+from array import array
 from collections import defaultdict
 
 import plac
+import numpy
 try:
     import ujson as json
 except ImportError:
@@ -17,27 +20,210 @@ from preshed.counter import PreshCounter
 from spacy.strings import hash_string
 import spacy
 
+import _shared  # shards, from pywikitools
+from shards import ShardReader, is_shard_directory
+from word_freqs import imap_bounded, iter_batches
+
 logger = logging.getLogger(__name__)
 
 
+_nlp = None
+
+
+def load_tokenizer(lang):
+    global _nlp
+    _nlp = spacy.load(lang, parser=False, tagger=False, entity=False)
+
+
+def tokenize_batch(lines):
+    # Only the tokenizer runs, since the pipeline is disabled at load time.
+    sents = []
+    for doc in _nlp.pipe(lines):
+        words = [word.orth_ for word in doc if not word.is_space]
+        if words:
+            sents.append(words)
+    return sents
+
+
+STAMP_SUFFIX = '.stamp'
+
+
+def corpus_stamp(directory, lang):
+    """What a tokenized cache was made from: the input directory, the
+    language, and the size and mtime of every input file."""
+    files = sorted([path.relpath(loc, directory), os.path.getsize(loc), int(os.path.getmtime(loc))]
+                   for loc in iter_dir(directory))
+    return {'in_dir': path.abspath(directory), 'lang': lang, 'files': files}
+
+
+def write_stamp(loc, stamp):
+    with io.open(loc + STAMP_SUFFIX, 'w', encoding='utf8') as file_:
+        file_.write(json.dumps(stamp))
+
+
+def has_stamp(loc, stamp):
+    """Whether the cache at loc was made from the input described by stamp."""
+    try:
+        with io.open(loc + STAMP_SUFFIX, 'r', encoding='utf8') as file_:
+            return json.loads(file_.read()) == stamp
+    except (IOError, OSError, ValueError):
+        return False
+
+
 class Corpus(object):
-    def __init__(self, directory, min_freq=10):
+    """Stream the lines of the files in a directory as tokenized sentences.
+    The first pass tokenizes batches of lines in a pool of n_workers
+    processes and writes the tokens to cache_loc, which later passes read
+    instead of tokenizing again."""
+    def __init__(self, directory, lang, min_freq=10, n_workers=1, batch_size=1000,
+                 cache_loc=None):
         self.directory = directory
+        self.lang = lang
         self.counts = PreshCounter()
         self.strings = {}
         self.min_freq = min_freq
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.cache_loc = cache_loc
 
-    def count_doc(self, doc):
-        # Get counts for this document
-        for word in doc:
-            self.counts.inc(word.orth, 1)
-        return len(doc)
+    def count_words(self, words):
+        # Get counts for this sentence
+        for word in words:
+            key = hash_string(word)
+            self.counts.inc(key, 1)
+            if key not in self.strings:
+                self.strings[key] = word
+        return len(words)
 
-    def __iter__(self):
+    def iter_lines(self):
+        if is_shard_directory(self.directory):
+            # Articles extracted by pywikitools into shards, read in order.
+            for text in ShardReader(self.directory).iter_texts():
+                for line in text.split('\n'):
+                    line = line.strip()
+                    if line:
+                        yield line
+            return
         for text_loc in iter_dir(self.directory):
             with io.open(text_loc, 'r', encoding='utf8') as file_:
-                text = file_.read()
-            yield text
+                for line in file_:
+                    line = line.strip()
+                    if line:
+                        yield line
+
+    def cache_is_valid(self):
+        if self.cache_loc is None or not path.exists(self.cache_loc):
+            return False
+        if not has_stamp(self.cache_loc, corpus_stamp(self.directory, self.lang)):
+            logger.warning("%s was made from other input, tokenizing again", self.cache_loc)
+            return False
+        return True
+
+    def iter_sentence_batches(self):
+        if self.cache_is_valid():
+            with io.open(self.cache_loc, 'r', encoding='utf8') as file_:
+                for lines in iter_batches(file_, self.batch_size):
+                    yield [line.rstrip('\n').split(' ') for line in lines]
+            return
+        cache = None
+        if self.cache_loc is not None:
+            stamp = corpus_stamp(self.directory, self.lang)
+            cache = io.open(self.cache_loc + '.tmp', 'w', encoding='utf8')
+        pool = multiprocessing.Pool(self.n_workers, initializer=load_tokenizer,
+                                    initargs=(self.lang,))
+        try:
+            for sents in imap_bounded(pool, tokenize_batch,
+                                      iter_batches(self.iter_lines(), self.batch_size),
+                                      self.n_workers * 2):
+                if cache is not None:
+                    for words in sents:
+                        cache.write(' '.join(words) + '\n')
+                yield sents
+        finally:
+            pool.terminate()
+            if cache is not None:
+                cache.close()
+        # Only a complete pass is used as the cache.
+        if cache is not None:
+            os.rename(self.cache_loc + '.tmp', self.cache_loc)
+            write_stamp(self.cache_loc, stamp)
+
+    def __iter__(self):
+        for sents in self.iter_sentence_batches():
+            for words in sents:
+                yield words
+
+
+class BinaryCorpus(object):
+    """Tokenized corpus stored as int32 token IDs, with int64 offsets where
+    each sentence starts and a JSON table from IDs to strings. The arrays are
+    memory-mapped, so iterating the sentences doesn't copy them, and the word
+    counts are a bincount over the IDs."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.ids = self._load(path.join(directory, 'ids.int32'), '<i4')
+        self.offsets = self._load(path.join(directory, 'offsets.int64'), '<i8')
+        with io.open(path.join(directory, 'strings.json'), 'r', encoding='utf8') as file_:
+            self.strings = json.load(file_)
+
+    @staticmethod
+    def _load(loc, dtype):
+        if os.path.getsize(loc) == 0:
+            return numpy.zeros((0,), dtype=dtype)
+        return numpy.memmap(loc, dtype=dtype, mode='r')
+
+    @staticmethod
+    def exists(directory):
+        # The table is written last, so the corpus is complete if it's there.
+        return path.exists(path.join(directory, 'strings.json'))
+
+    @classmethod
+    def write(cls, corpus, directory):
+        """Tokenize the raw text of a Corpus once, writing the token IDs and
+        counting the words in corpus.counts as we go. IDs are given out in
+        the order the strings are first seen."""
+        if not path.exists(directory):
+            os.makedirs(directory)
+        ids = {}
+        strings = []
+        offsets = array('q', [0])
+        total_words = 0
+        with open(path.join(directory, 'ids.int32'), 'wb') as file_:
+            for batch_no, sents in enumerate(corpus.iter_sentence_batches()):
+                batch = []
+                for words in sents:
+                    total_words += corpus.count_words(words)
+                    for word in words:
+                        key = hash_string(word)
+                        if key not in ids:
+                            ids[key] = len(strings)
+                            strings.append(word)
+                        batch.append(ids[key])
+                    offsets.append(offsets[-1] + len(words))
+                file_.write(numpy.asarray(batch, dtype='<i4').tobytes())
+                logger.info("PROGRESS: at batch #%i, processed %i words, keeping %i word types",
+                            batch_no, total_words, len(strings))
+        with open(path.join(directory, 'offsets.int64'), 'wb') as file_:
+            file_.write(numpy.asarray(offsets, dtype='<i8').tobytes())
+        tmp_loc = path.join(directory, 'strings.json.tmp')
+        with io.open(tmp_loc, 'w', encoding='utf8') as file_:
+            file_.write(json.dumps(strings, ensure_ascii=False))
+        os.rename(tmp_loc, path.join(directory, 'strings.json'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def iter_counts(self):
+        counts = numpy.bincount(self.ids, minlength=len(self.strings))
+        for id_, freq in enumerate(counts.tolist()):
+            yield self.strings[id_], freq
+
+    def __iter__(self):
+        strings = self.strings
+        for i in range(len(self)):
+            sent = self.ids[self.offsets[i]:self.offsets[i + 1]]
+            yield [strings[id_] for id_ in sent.tolist()]
+
 
 def iter_dir(loc):
     for fn in os.listdir(loc):
@@ -47,9 +233,10 @@ def iter_dir(loc):
         else:
             yield path.join(loc, fn)
 
+
 @plac.annotations(
     lang=("ISO language code"),
-    in_dir=("Location of input directory"),
+    in_dir=("Location of input directory, of text files or of pywikitools shards"),
     out_loc=("Location of output file"),
     n_workers=("Number of workers", "option", "n", int),
     size=("Dimension of the word vectors", "option", "d", int),
@@ -57,8 +244,12 @@ def iter_dir(loc):
     min_count=("Min count", "option", "m", int),
     negative=("Number of negative samples", "option", "g", int),
     nr_iter=("Number of iterations", "option", "i", int),
+    batch_size=("Number of lines per tokenizer batch", "option", "b", int),
+    cache_loc=("Location of the tokenized corpus cache (default: out_loc + '.tokens')", "option", "c", str),
+    binary_dir=("Directory of a binary token ID corpus, used for counting and training", "option", "B", str),
 )
-def main(lang, in_dir, out_loc, negative=5, n_workers=4, window=5, size=128, min_count=10, nr_iter=2):
+def main(lang, in_dir, out_loc, negative=5, n_workers=4, window=5, size=128, min_count=10, nr_iter=2,
+         batch_size=1000, cache_loc=None, binary_dir=None):
     logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
     model = Word2Vec(
         size=size,
@@ -68,23 +259,36 @@ def main(lang, in_dir, out_loc, negative=5, n_workers=4, window=5, size=128, min
         sample=1e-5,
         negative=negative
     )
-    nlp = spacy.load(lang, parser=False, tagger=False, entity=False)
-    corpus = Corpus(in_dir)
-    total_words = 0
-    total_sents = 0
-    for text_no, text_loc in enumerate(iter_dir(corpus.directory)):
-        with io.open(text_loc, 'r', encoding='utf8') as file_:
-            text = file_.read()
-        total_sents += text.count('\n')
-        doc = nlp(text)
-        total_words += corpus.count_doc(doc)  
-        logger.info("PROGRESS: at batch #%i, processed %i words, keeping %i word types",
-                    text_no, total_words, len(corpus.strings))
+    if binary_dir is not None:
+        stamp = corpus_stamp(in_dir, lang)
+        stamp_loc = path.join(binary_dir, 'strings.json')
+        if not BinaryCorpus.exists(binary_dir) or not has_stamp(stamp_loc, stamp):
+            raw = Corpus(in_dir, lang, min_freq=min_count, n_workers=n_workers,
+                         batch_size=batch_size)
+            BinaryCorpus.write(raw, binary_dir)
+            write_stamp(stamp_loc, stamp)
+        corpus = BinaryCorpus(binary_dir)
+        total_sents = len(corpus)
+        vocab = corpus.iter_counts()
+    else:
+        if cache_loc is None:
+            cache_loc = out_loc + '.tokens'
+        corpus = Corpus(in_dir, lang, min_freq=min_count, n_workers=n_workers,
+                        batch_size=batch_size, cache_loc=cache_loc)
+        total_words = 0
+        total_sents = 0
+        for batch_no, sents in enumerate(corpus.iter_sentence_batches()):
+            for words in sents:
+                total_words += corpus.count_words(words)
+            total_sents += len(sents)
+            logger.info("PROGRESS: at batch #%i, processed %i words, keeping %i word types",
+                        batch_no, total_words, len(corpus.strings))
+        vocab = ((corpus.strings[key], freq) for key, freq in corpus.counts)
     model.corpus_count = total_sents
     model.raw_vocab = defaultdict(int)
-    for orth, freq in corpus.counts.items():
+    for word, freq in vocab:
         if freq >= min_count:
-            model.raw_vocab[nlp.vocab.strings[orth]] = freq
+            model.raw_vocab[word] = freq
     model.scale_vocab()
     model.finalize_vocab()
     model.iter = nr_iter